@@ -0,0 +1,140 @@
+"""
+Per-event CPU and bytes on the wire for event preparation, JSON encoding and compression.
+
+Compares the original _prepare_event (rebuilding the request context for
+every event) with the per-request memo, stdlib json as requests used it
+with the configurable encoders, and uncompressed bodies with gzip and zstd
+for single events and batches. Encoders and codecs whose package is not
+installed are skipped.
+
+Usage:
+    python -m benchmarks.bench_event_encoding [--requests N] [--events-per-request N] [--batch N]
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+
+from flask import Flask, g, request, session
+
+from utils import encoding
+from utils.encoding import PayloadEncoder
+from utils.gtm_server import GTMServerSide
+
+
+def legacy_prepare(container_id, event_name, event_data=None):
+    """_prepare_event as it was before the request context was memoised."""
+    if event_data is None:
+        event_data = {}
+    if 'client_id' not in session:
+        session['client_id'] = str(uuid.uuid4())
+    event_data.update({
+        'event': event_name,
+        'client_id': session['client_id'],
+        'page_location': request.url,
+        'page_path': request.path,
+        'page_referrer': request.referrer or '',
+        'user_agent': request.user_agent.string,
+        'timestamp': datetime.utcnow().isoformat(),
+        'ip_override': request.remote_addr,
+        'container_id': container_id
+    })
+    if hasattr(g, 'user') and g.user:
+        event_data['user_id'] = g.user.id
+    return event_data
+
+
+def item_data(i):
+    return {'items': [{'item_id': i, 'item_name': 'Noise-cancelling wireless headphones',
+                       'price': 199.99, 'quantity': 1, 'currency': 'USD'}]}
+
+
+def bench_prepare(app, gtm, requests, per_request):
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+        'Referer': 'https://shop.example/'
+    }
+    results = {}
+    for label, prepare in (('original', lambda name, data: legacy_prepare(gtm.container_id, name, data)),
+                           ('memoised', gtm._prepare_event)):
+        elapsed = 0.0
+        for i in range(requests):
+            with app.test_request_context(f'/product/{i % 50}?ref=bench', headers=headers):
+                started = time.perf_counter()
+                for n in range(per_request):
+                    prepare('view_item', item_data(n))
+                elapsed += time.perf_counter() - started
+        results[label] = elapsed / (requests * per_request)
+    return results
+
+
+def bench_encoders(event, rounds):
+    encoders = [('requests json', lambda obj: json.dumps(obj).encode('utf-8'))]
+    encoders.append(('json', PayloadEncoder(json_encoder='json').dumps))
+    if encoding.orjson is not None:
+        encoders.append(('orjson', PayloadEncoder(json_encoder='orjson').dumps))
+    results = []
+    for label, dumps in encoders:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            body = dumps(event)
+        results.append((label, (time.perf_counter() - started) / rounds, len(body)))
+    return results
+
+
+def bench_compression(events, batch, rounds):
+    single = PayloadEncoder(json_encoder='json').dumps(events[0])
+    batch_body = b'{"events":[' + b','.join(PayloadEncoder(json_encoder='json').dumps(e) for e in events[:batch]) + b']}'
+    codecs = [None, 'gzip']
+    if encoding.zstandard is not None:
+        codecs.append('zstd')
+    results = []
+    for codec in codecs:
+        encoder = PayloadEncoder(json_encoder='json', compression=codec, min_bytes=0)
+        for label, body, count in (('single', single, 1), (f'batch of {batch}', batch_body, batch)):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                compressed, _ = encoder.compress(body)
+            per_event = (time.perf_counter() - started) / rounds / count
+            results.append((codec or 'none', label, per_event, len(compressed) / count))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--events-per-request', type=int, default=2, help="a product page sends page_view and view_item")
+    parser.add_argument('--batch', type=int, default=25)
+    parser.add_argument('--rounds', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    gtm = GTMServerSide('http://127.0.0.1:9', 'GTM-BENCH')
+
+    prepare = bench_prepare(app, gtm, args.requests, args.events_per_request)
+    print(f"prepare ({args.events_per_request} events per request)")
+    for label, seconds in prepare.items():
+        print(f"  {label:<14} {seconds * 1e6:>8.2f} us/event")
+    print(f"  saving         {(1 - prepare['memoised'] / prepare['original']):>8.0%}")
+
+    with app.test_request_context('/product/1?ref=bench'):
+        events = [gtm._prepare_event('view_item', item_data(i)) for i in range(args.batch)]
+
+    print("json encoding")
+    for label, seconds, size in bench_encoders(events[0], args.rounds):
+        print(f"  {label:<14} {seconds * 1e6:>8.2f} us/event  {size:>6} bytes")
+    if encoding.orjson is None:
+        print("  orjson         not installed")
+
+    print("compression")
+    for codec, label, seconds, size in bench_compression(events, args.batch, max(args.rounds // 10, 1)):
+        print(f"  {codec:<5} {label:<12} {seconds * 1e6:>8.2f} us/event  {size:>8.1f} bytes/event")
+    if encoding.zstandard is None:
+        print("  zstd           not installed")
+    gtm.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Debug event history: the original list (insert(0) + linear filter) vs EventRing.
+
+Usage:
+    python -m benchmarks.bench_event_history [--capacity N] [--writers T] [--events N]
+"""
+import argparse
+import threading
+import time
+
+from utils.event_history import EventRing
+
+EVENT_NAMES = ['page_view', 'view_item', 'add_to_cart', 'user_logout', 'purchase']
+
+
+class ListHistory:
+    """The event_history list as GTMServerSide kept it before EventRing."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.events = []
+
+    def append(self, record):
+        self.events.insert(0, record)
+        if len(self.events) > self.capacity:
+            self.events.pop()
+
+    def latest(self, limit=10, event_name=None):
+        if event_name:
+            return [e for e in self.events if e['event_name'] == event_name][:limit]
+        return self.events[:limit]
+
+
+def bench_writes(history, writers, events):
+    def worker(offset):
+        for i in range(events // writers):
+            history.append({'event_name': EVENT_NAMES[(i + offset) % len(EVENT_NAMES)], 'data': {}})
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(writers)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - started
+
+
+def bench_debug_page(history, renders):
+    # /gtm/debug asks for four event types plus the overall latest 20
+    started = time.perf_counter()
+    for _ in range(renders):
+        for name in ('page_view', 'view_item', 'add_to_cart', 'user_logout'):
+            history.latest(10, name)
+        history.latest(20)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--capacity', type=int, default=10000)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--renders', type=int, default=1000)
+    args = parser.parse_args()
+
+    for label, history in (('list', ListHistory(args.capacity)), ('ring', EventRing(args.capacity))):
+        write_time = bench_writes(history, args.writers, args.events)
+        read_time = bench_debug_page(history, args.renders)
+        print(f"{label:<5} append {write_time / args.events * 1e6:>8.2f} us/event   "
+              f"debug render {read_time / args.renders * 1e6:>10.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+send_event latency with and without /gtm/stream subscribers.
+
+Half of the subscribers read continuously, the other half never read and
+get evicted, like a stalled browser tab. Fails (exit status 1) if p50 or p99
+with subscribers is more than the allowed ratio of the run without them, if
+a stalled subscriber is not evicted, or if a reading subscriber misses an
+event.
+
+Usage:
+    python -m benchmarks.bench_fanout [--subscribers N] [--events N] [--repeat N]
+"""
+import argparse
+import sys
+import threading
+import time
+
+from flask import Flask
+
+from benchmarks.stub_server import StubTaggingServer
+from utils.gtm_server import GTMServerSide
+
+
+def measure(gtm, app, events, rate):
+    timings = []
+    interval = 1.0 / rate
+    with app.test_request_context('/product/1'):
+        next_send = time.perf_counter()
+        for i in range(events):
+            started = time.perf_counter()
+            gtm.send_event('view_item', {'items': [{'item_id': i}]})
+            timings.append(time.perf_counter() - started)
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+def measure_repeated(gtm, app, args):
+    """Median p50 and p99 over args.repeat runs."""
+    runs = [measure(gtm, app, args.events, args.rate) for _ in range(args.repeat)]
+    p50s = sorted(p50 for p50, _ in runs)
+    p99s = sorted(p99 for _, p99 in runs)
+    return p50s[len(runs) // 2], p99s[len(runs) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--subscribers', type=int, default=100)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=2000, help="events sent per second")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case, the median is kept")
+    parser.add_argument('--max-p50-ratio', type=float, default=1.25,
+                        help="allowed p50 with subscribers relative to without")
+    parser.add_argument('--max-p99-ratio', type=float, default=2.0,
+                        help="allowed p99 with subscribers relative to without")
+    args = parser.parse_args()
+
+    stub = StubTaggingServer()
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    gtm = GTMServerSide(stub.url, 'GTM-BENCH', dispatch_config={
+        'enabled': True, 'max_queue_size': 100000, 'workers': 4
+    })
+
+    base_p50, base_p99 = measure_repeated(gtm, app, args)
+    print(f"{0:>4} subscribers  p50 {base_p50 * 1e6:>7.1f} us  p99 {base_p99 * 1e6:>7.1f} us")
+
+    stop = threading.Event()
+    readers_count = args.subscribers // 2
+    readers = [gtm.subscribe(max_buffer=1000) for _ in range(readers_count)]
+    stalled = [gtm.subscribe(max_buffer=100) for _ in range(args.subscribers - readers_count)]
+    received = [0] * readers_count
+
+    def drain(n, subscription):
+        while not stop.is_set():
+            events = subscription.get(timeout=0.1)
+            if events is None:
+                return
+            received[n] += len(events)
+
+    threads = [threading.Thread(target=drain, args=(n, s), daemon=True) for n, s in enumerate(readers)]
+    for t in threads:
+        t.start()
+
+    p50, p99 = measure_repeated(gtm, app, args)
+    sent = args.events * args.repeat
+
+    # Let the readers pick up what is still waiting; a stalled subscriber
+    # finds out it was evicted on its next read
+    deadline = time.monotonic() + 5.0
+    while min(received, default=sent) < sent and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop.set()
+    stalled_reads = [s.get(timeout=0) for s in stalled]
+    print(f"{args.subscribers:>4} subscribers  p50 {p50 * 1e6:>7.1f} us  p99 {p99 * 1e6:>7.1f} us  "
+          f"{gtm.broadcaster.stats()}")
+    gtm.shutdown(timeout=30)
+    stub.stop()
+
+    failures = []
+    if p50 > base_p50 * args.max_p50_ratio:
+        failures.append(f"p50 is {p50 / base_p50:.2f}x the run without subscribers "
+                        f"(allowed {args.max_p50_ratio}x)")
+    if p99 > base_p99 * args.max_p99_ratio:
+        failures.append(f"p99 is {p99 / base_p99:.2f}x the run without subscribers "
+                        f"(allowed {args.max_p99_ratio}x)")
+    not_evicted = sum(1 for s, events in zip(stalled, stalled_reads) if events is not None or not s.evicted)
+    if not_evicted:
+        failures.append(f"{not_evicted} of {len(stalled)} stalled subscribers were not evicted")
+    lost = sum(1 for s, count in zip(readers, received) if s.evicted or count != sent)
+    if lost:
+        failures.append(f"{lost} of {readers_count} reading subscribers missed events "
+                        f"(received {min(received)}-{max(received)} of {sent})")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Throughput of GTMServerSide.send_event, single-event vs batched delivery.
+
+Usage:
+    python -m benchmarks.bench_gtm_throughput [--events N] [--threads T]
+"""
+import argparse
+import threading
+import time
+
+from flask import Flask
+
+from benchmarks.stub_server import StubTaggingServer
+from utils.gtm_server import GTMServerSide
+
+
+def run(label, stub, events, threads, **config):
+    gtm = GTMServerSide(stub.url, 'GTM-BENCH', **config)
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    start_requests, start_events = stub.requests, stub.events
+
+    def worker(count):
+        with app.test_request_context('/product/1'):
+            for i in range(count):
+                gtm.send_event('view_item', {'items': [{'item_id': i, 'price': 9.99}]})
+
+    per_thread = events // threads
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    gtm.shutdown(timeout=60)
+    elapsed = time.perf_counter() - started
+
+    delivered = stub.events - start_events
+    print(f"{label:<10} {delivered:>8} events  {stub.requests - start_requests:>7} requests  "
+          f"{elapsed:>7.2f}s  {delivered / elapsed:>10.0f} events/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    stub = StubTaggingServer()
+    try:
+        run('single', stub, args.events, args.threads)
+        run('batched', stub, args.events, args.threads,
+            batch_config={'enabled': True, 'max_events': 50, 'max_bytes': 64 * 1024, 'max_wait_ms': 50})
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
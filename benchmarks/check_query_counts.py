@@ -0,0 +1,115 @@
+"""
+Query-count check for the order listings: /orders, /admin/orders (HTML and
+JSON) and the other admin listings must run the same number of SQL
+statements however many orders, items and users there are. Fails (exit
+status 1) if any page's count grows with the data, which is what an N+1
+lazy load looks like.
+
+Runs against a scratch database unless DATABASE_URL is already set.
+
+Usage:
+    python -m benchmarks.check_query_counts [--small N] [--large N] [--items N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import uuid
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='query-counts-'), 'shop.db')}"
+
+from sqlalchemy import event  # noqa: E402
+
+import server  # noqa: E402  (must be imported after DATABASE_URL is set)
+from server import app, db, User, Product, Order, OrderItem  # noqa: E402
+
+PAGES = ('/orders', '/admin/orders', '/admin/orders?format=json', '/admin/products', '/admin/users')
+
+
+def add_orders(user_id, product_ids, count, items_per_order):
+    """Give user_id count orders of items_per_order distinct products each."""
+    for n in range(count):
+        order = Order(user_id=user_id, complete=True)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all(OrderItem(order_id=order.id, product_id=product_ids[(n + i) % len(product_ids)], quantity=1)
+                           for i in range(items_per_order))
+    db.session.commit()
+
+
+def add_users(count):
+    tag = uuid.uuid4().hex[:8]
+    db.session.add_all(User(username=f'qc_{tag}_{n}', email=f'qc_{tag}_{n}@example.com', password_hash='-')
+                       for n in range(count))
+    db.session.commit()
+
+
+def count_queries(client, path):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path}: HTTP {response.status_code}")
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--small', type=int, default=3, help="orders (and extra users) in the first pass")
+    parser.add_argument('--large', type=int, default=40, help="orders (and extra users) in the second pass")
+    parser.add_argument('--items', type=int, default=3, help="items per order")
+    args = parser.parse_args()
+
+    with app.app_context():
+        server.init_db()
+        admin = User.query.filter_by(is_admin=True).first()
+        products = [Product(name=f'Query Count Item {n}', description='', price=1.0 + n, stock=100)
+                    for n in range(args.items + 2)]
+        db.session.add_all(products)
+        db.session.commit()
+        admin_id = admin.id
+        product_ids = [p.id for p in products]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        # Log in without going through the password pool or the login limiter
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+
+    counts = {}
+    for label, total in (('small', args.small), ('large', args.large)):
+        with app.app_context():
+            existing = Order.query.filter_by(user_id=admin_id).count()
+            add_orders(admin_id, product_ids, total - existing, args.items)
+            add_users(total - (User.query.count() - 1))
+        # Warm the page, catalog and user caches so only the listing itself is counted
+        for path in PAGES:
+            count_queries(client, path)
+        counts[label] = {path: count_queries(client, path) for path in PAGES}
+
+    failed = False
+    print(f"{'page':<28} {args.small:>6} rows {args.large:>6} rows")
+    for path in PAGES:
+        small, large = counts['small'][path], counts['large'][path]
+        flag = '' if small == large else '  FAIL: grows with row count'
+        failed = failed or bool(flag)
+        print(f"{path:<28} {small:>11} {large:>11}{flag}")
+
+    if failed:
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Load test for the /collect ingestion pipeline.
+
+Without --url, NDJSON bodies are fed straight to CollectIngestor, which
+measures parsing, validation, rate limiting and the sink. With --url, a
+running server is hit over HTTP from --threads keep-alive sessions.
+
+Usage:
+    python -m benchmarks.load_collect [--sink memory|sqlite|spool] [--events N] [--batch N]
+    python -m benchmarks.load_collect --url http://127.0.0.1:5015 [--threads T]
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def ndjson_batch(size, client):
+    lines = []
+    for i in range(size):
+        lines.append(json.dumps({
+            'event': 'page_view',
+            'client_id': client,
+            'page_location': f'https://shop.example/product/{i % 50}',
+            'timestamp': time.time(),
+            'params': {'engagement_time_msec': 120}
+        }))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def run_in_process(args):
+    from utils.ingest import CollectIngestor, build_sink
+
+    tmp = tempfile.mkdtemp(prefix='collect-bench-')
+    sink = build_sink({
+        'sink': args.sink,
+        'sqlite_path': os.path.join(tmp, 'events.db'),
+        'spool_directory': os.path.join(tmp, 'spool')
+    })
+    ingestor = CollectIngestor(sink, rate=1e9, burst=1e9)
+    body = ndjson_batch(args.batch, 'bench')
+    requests_needed = args.events // args.batch
+
+    started = time.perf_counter()
+    for _ in range(requests_needed):
+        ingestor.ingest(io.BytesIO(body), 'application/x-ndjson', '127.0.0.1')
+    elapsed = time.perf_counter() - started
+    accepted = ingestor.stats()['accepted']
+    print(f"in-process sink={args.sink:<7} {accepted} events in {elapsed:.2f}s  "
+          f"{accepted / elapsed:>10.0f} events/s")
+
+
+def run_http(args):
+    per_thread = args.events // args.batch // args.threads
+    counts = {'accepted': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def worker(n):
+        session = requests.Session()
+        body = ndjson_batch(args.batch, f'load-{n}')
+        for _ in range(per_thread):
+            response = session.post(f"{args.url}/collect", data=body,
+                                    headers={'Content-Type': 'application/x-ndjson'})
+            with lock:
+                if response.status_code == 204:
+                    counts['accepted'] += args.batch
+                else:
+                    counts['failed'] += args.batch
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    print(f"http {args.url}  {counts['accepted']} accepted, {counts['failed']} failed in {elapsed:.2f}s  "
+          f"{counts['accepted'] / elapsed:>10.0f} events/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="base URL of a running server")
+    parser.add_argument('--sink', default='memory', choices=['memory', 'sqlite', 'spool'])
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=100, help="events per NDJSON request")
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.url:
+        run_http(args)
+    else:
+        run_in_process(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Concurrency stress test for checkout.
+
+Many users race for a product with limited stock; then one user submits
+the same cart several times at once (a double-clicked checkout button).
+Fails (exit status 1) if stock goes negative, if stock plus ordered
+quantity does not add up to the initial stock, or if the repeated
+submissions produce more than one order.
+
+Runs against a scratch database unless DATABASE_URL is already set.
+
+Usage:
+    python -m benchmarks.stress_checkout [--users N] [--stock N] [--quantity N] [--submissions N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+from werkzeug.security import generate_password_hash
+
+from utils.config import AUTH_CONFIG
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='checkout-stress-'), 'shop.db')}"
+
+# A cheap hash keeps setup fast and matches the configured method, so logins
+# verify without rehashing; every shopper logs in at once
+HASH_METHOD = 'pbkdf2:sha256:1'
+AUTH_CONFIG['hashing'] = dict(AUTH_CONFIG['hashing'], method=HASH_METHOD, max_pending=1000)
+
+import server  # noqa: E402  (must be imported after DATABASE_URL is set)
+from server import app, db, User, Product, CartItem, Order, OrderItem  # noqa: E402
+
+
+def create_shoppers(count, stock, quantity, label):
+    """A product with stock and count users each holding quantity of it in their cart."""
+    with app.app_context():
+        product = Product(name=f'Stress Test Item ({label})', description='', price=10.0, stock=stock)
+        db.session.add(product)
+        users = []
+        for n in range(count):
+            name = f'stress_{os.getpid()}_{label}_{n}'
+            user = User(username=name, email=f'{name}@example.com')
+            user.password_hash = generate_password_hash('stress', method=HASH_METHOD)
+            users.append(user)
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all(CartItem(user_id=u.id, product_id=product.id, quantity=quantity) for u in users)
+        db.session.commit()
+        return product.id, [u.username for u in users]
+
+
+def race_checkouts(usernames):
+    """Log every client in, then have them all GET /checkout at once."""
+    barrier = threading.Barrier(len(usernames))
+    errors = []
+
+    def shopper(username):
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': 'stress'})
+        barrier.wait()
+        try:
+            response = client.get('/checkout')
+            if response.status_code >= 500:
+                errors.append(f"{username}: HTTP {response.status_code}")
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=shopper, args=(name,)) for name in usernames]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def ordered_quantity(product_id):
+    return db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).filter(
+        OrderItem.product_id == product_id).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--stock', type=int, default=25)
+    parser.add_argument('--quantity', type=int, default=2, help="quantity in each user's cart")
+    parser.add_argument('--submissions', type=int, default=8, help="simultaneous checkouts of one user's cart")
+    args = parser.parse_args()
+
+    with app.app_context():
+        server.init_db()
+    failed = False
+
+    # Many users, limited stock
+    product_id, usernames = create_shoppers(args.users, args.stock, args.quantity, 'users')
+    errors = race_checkouts(usernames)
+    with app.app_context():
+        stock = db.session.get(Product, product_id).stock
+        ordered = ordered_quantity(product_id)
+    print(f"many users: initial stock {args.stock}, demand {args.users * args.quantity}, "
+          f"ordered {ordered}, remaining {stock}, errors {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {error}")
+    if stock < 0 or stock + ordered != args.stock:
+        print("FAIL: stock accounting is inconsistent")
+        failed = True
+
+    # One user, the same cart submitted several times
+    product_id, (username,) = create_shoppers(1, args.stock, args.quantity, 'same-user')
+    errors = race_checkouts([username] * args.submissions)
+    with app.app_context():
+        stock = db.session.get(Product, product_id).stock
+        ordered = ordered_quantity(product_id)
+        orders = Order.query.join(User).filter(User.username == username).count()
+    print(f"same user x{args.submissions}: orders {orders}, ordered {ordered}, "
+          f"remaining {stock} of {args.stock}, errors {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {error}")
+    if orders != 1 or ordered != args.quantity or stock != args.stock - args.quantity:
+        print("FAIL: one cart was checked out more than once")
+        failed = True
+
+    if failed:
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Local stand-in for the GTM tagging server used by the benchmarks."""
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubTaggingServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, error_status=503,
+                 timeout_rate=0.0, hang_seconds=30.0, seed=None):
+        """
+        Start a threaded HTTP server that accepts POSTs to /collect.
+
+        Faults are injected per request: a fraction of requests answer with
+        error_status, and a fraction hang for hang_seconds without answering,
+        which the client sees as a read timeout. The settings are plain
+        attributes and can be changed while the server is running.
+
+        Args:
+            host (str): Interface to bind
+            port (int): Port to bind, 0 picks a free port
+            latency (float): Seconds to wait before answering each request
+            error_rate (float): Fraction of requests answered with error_status
+            error_status (int): HTTP status used for injected errors
+            timeout_rate (float): Fraction of requests that hang
+            hang_seconds (float): How long a hanging request stalls
+            seed (int, optional): Seed for reproducible fault injection
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self._random = random.Random(seed)
+
+        self.requests = 0
+        self.events = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                fault = stub._pick_fault()
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if fault == 'timeout':
+                    time.sleep(stub.hang_seconds)
+                    self.close_connection = True
+                    return
+                if fault == 'error':
+                    self.send_response(stub.error_status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                stub._record(body)
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _pick_fault(self):
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.timeout_rate:
+                self.timeouts += 1
+                return 'timeout'
+            if roll < self.timeout_rate + self.error_rate:
+                self.errors += 1
+                return 'error'
+        return None
+
+    def _record(self, body):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = {}
+        count = len(payload['events']) if isinstance(payload, dict) and 'events' in payload else 1
+        with self._lock:
+            self.requests += 1
+            self.events += count
+            self.bytes_received += len(body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'events': self.events,
+                'bytes_received': self.bytes_received,
+                'errors': self.errors,
+                'timeouts': self.timeouts
+            }
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,410 @@
+"""
+Benchmark suite for the tracking and storefront hot paths, with baseline comparison.
+
+Cases:
+    send_event       GTMServerSide.send_event against the stub tagging server,
+                     inline and dispatched, with injected latency, errors and timeouts
+    collect          NDJSON batches posted to /collect
+    storefront       /, /product/<id>, /cart and /checkout from concurrent clients
+    recent_events    get_recent_events as the event history grows
+
+Results are written as JSON (--output). With --baseline, every metric is
+compared against the stored run and the exit status is 1 if a throughput
+(_per_s, higher is better) or median/microbenchmark latency (_ms, _us, lower
+is better) regressed by more than --tolerance. p99 and drain times are
+reported but not gated. Baselines are only comparable on the machine that
+produced them; use --repeat on both runs to take the median of several
+runs when the machine is noisy.
+
+The storefront and collect cases run against a scratch database, spool
+and ingest store, and send tracking events to the stub server.
+
+Usage:
+    python -m benchmarks.suite [--quick] [--only CASE ...] [--output results.json]
+    python -m benchmarks.suite --baseline benchmarks/baseline.json [--tolerance 0.3]
+    python -m benchmarks.suite --repeat 3 --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from werkzeug.security import generate_password_hash
+
+from benchmarks.stub_server import StubTaggingServer
+
+SCRATCH = tempfile.mkdtemp(prefix='bench-suite-')
+STOREFRONT_PASSWORD = 'bench'
+STOREFRONT_HASH_METHOD = 'pbkdf2:sha256:1'
+_storefront_runs = iter(range(1000000))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def latency_summary(samples, elapsed, unit='ms'):
+    """Throughput and latency percentiles for a list of durations in seconds."""
+    scale = 1000.0 if unit == 'ms' else 1000000.0
+    return {
+        'ops_per_s': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        f'p50_{unit}': round(percentile(samples, 0.50) * scale, 3),
+        f'p99_{unit}': round(percentile(samples, 0.99) * scale, 3)
+    }
+
+
+def best_of(call, rounds=5, calls=2000):
+    """Seconds per call, from the fastest of several rounds."""
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(calls):
+            call()
+        best = min(best, (time.perf_counter() - started) / calls)
+    return best
+
+
+def run_threads(worker, count):
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(count)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+
+def load_server(stub):
+    """Import server.py wired to the stub tagging server and scratch storage."""
+    if 'server' in sys.modules:
+        return sys.modules['server']
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(SCRATCH, 'shop.db')}")
+    from utils.config import AUTH_CONFIG, GTM_CONFIG, INGEST_CONFIG
+    GTM_CONFIG['server_url'] = stub.url
+    GTM_CONFIG['container_config'] = None
+    GTM_CONFIG['spool'] = dict(GTM_CONFIG['spool'], directory=os.path.join(SCRATCH, 'spool'))
+    INGEST_CONFIG['sqlite_path'] = os.path.join(SCRATCH, 'collected_events.db')
+    INGEST_CONFIG['rate_limit'] = INGEST_CONFIG['burst'] = 1e9
+    # Cheap hashes for the storefront users, so logging them in is not what gets measured
+    AUTH_CONFIG['hashing'] = dict(AUTH_CONFIG['hashing'], method=STOREFRONT_HASH_METHOD, max_pending=1000)
+
+    import server
+    with server.app.app_context():
+        server.init_db()
+    return server
+
+
+def bench_send_event(args, stub):
+    from flask import Flask
+    from utils.gtm_server import GTMServerSide
+
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    http_config = {'pool_size': 4, 'connect_timeout': 1.0, 'read_timeout': 0.5, 'retries': 0}
+    spool_config = {'enabled': True, 'directory': os.path.join(SCRATCH, 'send-spool'), 'replay_interval': 3600}
+    scenarios = [
+        ('inline', {'latency': 0.0}, {}),
+        ('dispatched', {'latency': 0.005, 'error_rate': 0.05, 'timeout_rate': 0.01},
+         {'dispatch_config': {'enabled': True, 'max_queue_size': 10000, 'workers': 4}}),
+        ('batched', {'latency': 0.005, 'error_rate': 0.05, 'timeout_rate': 0.01},
+         {'dispatch_config': {'enabled': True, 'max_queue_size': 10000, 'workers': 2},
+          'batch_config': {'enabled': True, 'max_events': 50, 'max_wait_ms': 50}}),
+    ]
+
+    results = {}
+    for label, faults, config in scenarios:
+        # A stub per scenario, so events the storefront's GTM client or an
+        # earlier scenario is still delivering are not counted as delivered
+        target = StubTaggingServer(hang_seconds=1.0, seed=1, **faults)
+        gtm = GTMServerSide(target.url, 'GTM-BENCH', http_config=http_config, spool_config=spool_config, **config)
+        events = args.events // 10 if label == 'inline' else args.events
+        per_thread = events // args.threads
+        timings = [[] for _ in range(args.threads)]
+
+        def worker(n):
+            with app.test_request_context('/product/1'):
+                for i in range(per_thread):
+                    started = time.perf_counter()
+                    gtm.send_event('view_item', {'items': [{'item_id': i, 'price': 9.99}]})
+                    timings[n].append(time.perf_counter() - started)
+
+        elapsed = run_threads(worker, args.threads)
+        drain_started = time.perf_counter()
+        gtm.shutdown(timeout=60)
+        drain = time.perf_counter() - drain_started
+        stats = target.stats()
+        target.stop()
+
+        summary = latency_summary([t for chunk in timings for t in chunk], elapsed)
+        summary['drain_ms'] = round(drain * 1000, 1)
+        summary['delivered'] = stats['events']
+        summary['injected_errors'] = stats['errors']
+        summary['injected_timeouts'] = stats['timeouts']
+        results[f'send_event.{label}'] = summary
+    return results
+
+
+def bench_collect(args, stub):
+    server = load_server(stub)
+    batch = 100
+    line = json.dumps({'event': 'page_view', 'client_id': 'bench', 'page_location': 'https://shop.example/',
+                       'params': {'engagement_time_msec': 120}})
+    body = ('\n'.join([line] * batch) + '\n').encode('utf-8')
+    per_thread = max(args.events // batch // args.threads, 1)
+    timings = [[] for _ in range(args.threads)]
+
+    def worker(n):
+        client = server.app.test_client()
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            client.post('/collect', data=body, content_type='application/x-ndjson')
+            timings[n].append(time.perf_counter() - started)
+
+    elapsed = run_threads(worker, args.threads)
+    samples = [t for chunk in timings for t in chunk]
+    summary = latency_summary(samples, elapsed)
+    summary['events_per_s'] = round(len(samples) * batch / elapsed, 1)
+    return {'collect': summary}
+
+
+def bench_storefront(args, stub):
+    server = load_server(stub)
+    app, db = server.app, server.db
+
+    run = next(_storefront_runs)
+    with app.app_context():
+        product = server.Product(name='Bench Item', description='Benchmark product', price=10.0, stock=10 ** 9)
+        db.session.add(product)
+        users = []
+        for n in range(args.threads):
+            name = f'bench_{os.getpid()}_{run}_{n}'
+            user = server.User(username=name, email=f'{name}@example.com')
+            user.password_hash = generate_password_hash(STOREFRONT_PASSWORD, method=STOREFRONT_HASH_METHOD)
+            users.append(user)
+        db.session.add_all(users)
+        db.session.commit()
+        product_id = product.id
+        usernames = [u.username for u in users]
+
+    requests_per_thread = max(args.requests // args.threads, 1)
+    pages = [('home', '/'), ('product', f'/product/{product_id}'), ('cart', '/cart')]
+    results = {}
+
+    for label, path in pages:
+        timings = [[] for _ in range(args.threads)]
+        failures = []
+
+        def worker(n):
+            client = app.test_client()
+            if label == 'cart':
+                client.post('/login', data={'username': usernames[n], 'password': STOREFRONT_PASSWORD})
+            for _ in range(requests_per_thread):
+                started = time.perf_counter()
+                response = client.get(path)
+                timings[n].append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+        elapsed = run_threads(worker, args.threads)
+        summary = latency_summary([t for chunk in timings for t in chunk], elapsed)
+        summary['failures'] = len(failures)
+        results[f'storefront.{label}'] = summary
+
+    # Checkout: refill the cart, then time the checkout request alone
+    checkouts = max(requests_per_thread // 5, 1)
+    timings = [[] for _ in range(args.threads)]
+    failures = []
+
+    def shopper(n):
+        client = app.test_client()
+        client.post('/login', data={'username': usernames[n], 'password': STOREFRONT_PASSWORD})
+        for _ in range(checkouts):
+            client.post(f'/add_to_cart/{product_id}', data={'quantity': 1})
+            started = time.perf_counter()
+            response = client.get('/checkout')
+            timings[n].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                failures.append(response.status_code)
+
+    elapsed = run_threads(shopper, args.threads)
+    summary = latency_summary([t for chunk in timings for t in chunk], elapsed)
+    summary['failures'] = len(failures)
+    results['storefront.checkout'] = summary
+    return results
+
+
+def bench_recent_events(args, stub):
+    from utils.gtm_server import GTMServerSide
+
+    names = ['page_view', 'view_item', 'add_to_cart', 'user_logout']
+    results = {}
+    for size in (1000, 10000, 100000):
+        gtm = GTMServerSide(stub.url, 'GTM-BENCH', history_size=size)
+        for i in range(size):
+            gtm.event_history.append({'timestamp': '', 'event_name': names[i % len(names)], 'data': {}})
+        # A rare event name means the filtered lookup must skip most of the history
+        gtm.event_history.append({'timestamp': '', 'event_name': 'purchase', 'data': {}})
+
+        latest = best_of(lambda: gtm.get_recent_events(limit=20))
+        filtered = best_of(lambda: gtm.get_recent_events('purchase', limit=10))
+        results[f'recent_events.{size}'] = {
+            'latest_us': round(latest * 1000000, 2),
+            'filtered_us': round(filtered * 1000000, 2)
+        }
+        gtm.shutdown()
+    return results
+
+
+CASES = {
+    'send_event': bench_send_event,
+    'collect': bench_collect,
+    'storefront': bench_storefront,
+    'recent_events': bench_recent_events
+}
+
+
+def median_results(runs):
+    """Combine repeated runs by taking the median of every metric."""
+    combined = {}
+    for case in runs[0]:
+        combined[case] = {}
+        for metric in runs[0][case]:
+            values = sorted(run[case][metric] for run in runs)
+            combined[case][metric] = values[len(values) // 2]
+    return combined
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Relative changes smaller than these absolute amounts are treated as noise
+NOISE_FLOOR = {'_ms': 0.05, '_us': 1.0, '_per_s': 0.0}
+
+
+def gated(metric):
+    """
+    How a metric is checked for regressions.
+
+    Returns:
+        tuple: (higher_is_better, noise floor), or None for metrics that are
+            reported only. p99 and drain times swing too much between runs of
+            an in-process benchmark to gate on.
+    """
+    if metric.startswith('p99_') or metric.startswith('drain_'):
+        return None
+    for suffix, floor in NOISE_FLOOR.items():
+        if metric.endswith(suffix):
+            return suffix == '_per_s', floor
+    return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print each metric next to its baseline value.
+
+    Returns:
+        list: Names of metrics that regressed by more than tolerance
+    """
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            if not metric.endswith(tuple(NOISE_FLOOR)):
+                continue
+            old = baseline.get(case, {}).get(metric)
+            if not old:
+                print(f"  {case:<28} {metric:<14} {value:>12}   (no baseline)")
+                continue
+            change = (value - old) / old
+            flag = ''
+            rule = gated(metric)
+            if rule is None:
+                flag = '(not gated)'
+            else:
+                higher_is_better, floor = rule
+                worse = -change if higher_is_better else change
+                if worse > tolerance and abs(value - old) > floor:
+                    flag = 'REGRESSION'
+                    regressions.append(f'{case}.{metric}')
+            print(f"  {case:<28} {metric:<14} {value:>12} vs {old:<12} {change:>+7.1%}  {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=sorted(CASES), help="cases to run (default: all)")
+    parser.add_argument('--quick', action='store_true', help="smaller runs for a fast smoke check")
+    parser.add_argument('--events', type=int, default=5000, help="events per send_event/collect case")
+    parser.add_argument('--requests', type=int, default=800, help="requests per storefront page")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=1, help="run every case N times and keep the medians")
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--baseline', help="compare against results stored at this path")
+    parser.add_argument('--save-baseline', metavar='PATH', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed relative slowdown (0.3 = 30%%)")
+    args = parser.parse_args()
+    if args.quick:
+        args.events, args.requests, args.threads = 1000, 200, 4
+
+    stub = StubTaggingServer(seed=1)
+    runs = []
+    try:
+        for repeat in range(args.repeat):
+            results = {}
+            for name in args.only or CASES:
+                print(f"running {name} ({repeat + 1}/{args.repeat}) ...", flush=True)
+                results.update(CASES[name](args, stub))
+            runs.append(results)
+    finally:
+        stub.stop()
+    results = median_results(runs)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'events': args.events,
+            'requests': args.requests,
+            'threads': args.threads,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"compared with {args.baseline} (revision {baseline['meta'].get('revision')}):")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} metrics regressed more than {args.tolerance:.0%}")
+            return 1
+        print("OK")
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,12 @@
 # Activate the virtual environment
 source gtm_venv/bin/activate
 
+# Create tables and seed data before starting workers
+flask --app server init-db
+
+# Fingerprint and precompress static assets
+flask --app server build-assets
+
 # Kill any existing flask processes
 pkill -f "python server.py" || true
 
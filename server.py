@@ -1,27 +1,116 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, Response, stream_template, abort, session, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+import atexit
 import os
 from datetime import datetime
 from utils.gtm_server import GTMServerSide, track_pageview
-from utils.config import GTM_CONFIG
-import json
+from utils.config import GTM_CONFIG, INGEST_CONFIG, DATABASE_CONFIG, CACHE_CONFIG, IMAGE_CONFIG, ASSET_CONFIG, AUTH_CONFIG
+from utils.database import engine_options, configure_engine, upsert_increment
+from utils.migrations import run_migrations
+from utils.ingest import CollectIngestor, build_sink
+from utils.pagination import keyset_paginate
+from utils.catalog_cache import CatalogCache
+from utils.response_cache import RenderCache, strong_etag
+from utils.event_history import encode_record
+from utils.images import ImagePipeline
+from utils.assets import AssetManifest, build_assets, send_precompressed
+from utils.metrics import REGISTRY, instrument_flask, instrument_engine
+from utils.sql_profiler import SQLProfiler
+from utils.passwords import PasswordHasher, LoginLimiter, HasherBusy, LOGIN_ATTEMPTS
 
 app = Flask(__name__)
+# Behind nginx: take the client address from the X-Forwarded-For entry it
+# adds, so per-IP limits see clients rather than the proxy
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
 app.config['SECRET_KEY'] = '426415839e71b10a8c2cb9fbe55eaa9c'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///shop.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_CONFIG['uri']
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_CONFIG)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['ADMIN_PAGE_SIZE'] = 50
+app.config['ADMIN_MAX_PAGE_SIZE'] = 500
+
+# Password hashing in worker processes, forked here before any background
+# threads start, and login throttling checked before hashing
+password_hasher = PasswordHasher.from_config(AUTH_CONFIG.get('hashing'))
+password_hasher.start()
+login_limiter = LoginLimiter.from_config(AUTH_CONFIG.get('login_limits'))
 
 # Initialize GTM Server-Side Tracking
 gtm = GTMServerSide(
     gtm_server_url=GTM_CONFIG['server_url'],
     container_id=GTM_CONFIG['container_id'],
     api_secret=GTM_CONFIG.get('api_secret'),
-    container_config=GTM_CONFIG.get('container_config')
+    container_config=GTM_CONFIG.get('container_config'),
+    dispatch_config=GTM_CONFIG.get('dispatch'),
+    batch_config=GTM_CONFIG.get('batch'),
+    http_config=GTM_CONFIG.get('http'),
+    spool_config=GTM_CONFIG.get('spool'),
+    sampling_config=GTM_CONFIG.get('sampling'),
+    dedup_config=GTM_CONFIG.get('dedup'),
+    encoding_config=GTM_CONFIG.get('encoding'),
+    pageview_config=GTM_CONFIG.get('pageview'),
+    history_size=GTM_CONFIG.get('history_size', 1000)
+)
+
+# Ingestion pipeline for client-side hits posted to /collect
+collector = CollectIngestor(
+    build_sink(INGEST_CONFIG),
+    rate=INGEST_CONFIG.get('rate_limit', 1000),
+    burst=INGEST_CONFIG.get('burst'),
+    max_event_bytes=INGEST_CONFIG.get('max_event_bytes', 8192),
+    max_body_bytes=INGEST_CONFIG.get('max_body_bytes', 1024 * 1024)
+)
+atexit.register(collector.close)
+
+# Catalog cache so storefront pages do not query products on every request
+version_file = CACHE_CONFIG.get('shared_version_file')
+if version_file:
+    os.makedirs(app.instance_path, exist_ok=True)
+    version_file = os.path.join(app.instance_path, version_file)
+catalog_cache = CatalogCache(
+    ttl=CACHE_CONFIG.get('catalog_ttl', 300),
+    max_entries=CACHE_CONFIG.get('catalog_max_entries', 1024),
+    version_file=version_file,
+    check_interval=CACHE_CONFIG.get('version_check_interval', 1.0)
+)
+
+# Rendered pages for anonymous visitors and product grid fragments
+page_cache = RenderCache(max_entries=CACHE_CONFIG.get('page_max_entries', 512))
+fragment_cache = RenderCache(max_entries=CACHE_CONFIG.get('fragment_max_entries', 64))
+
+# Product image uploads: content-hashed originals plus resized variants built
+# in the background. Cached pages are dropped once variants are ready so they
+# stop pointing at the full-size original.
+image_pipeline = ImagePipeline(
+    os.path.join(app.root_path, IMAGE_CONFIG.get('directory', 'static/media')),
+    variants=IMAGE_CONFIG.get('variants'),
+    webp=IMAGE_CONFIG.get('webp', True),
+    jpeg_quality=IMAGE_CONFIG.get('jpeg_quality', 82),
+    webp_quality=IMAGE_CONFIG.get('webp_quality', 80),
+    workers=IMAGE_CONFIG.get('workers', 2),
+    on_complete=lambda digest: catalog_cache.invalidate()
 )
 
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_engine(db.engine, DATABASE_CONFIG)
+    instrument_engine(db.engine)
+
+# Request, template and query timings for /metrics
+instrument_flask(app)
+
+# Per-request query profile and slow-query log, when enabled
+sql_profiler = SQLProfiler.from_config(DATABASE_CONFIG.get('profiler'))
+if sql_profiler:
+    with app.app_context():
+        sql_profiler.instrument(db.engine)
+    sql_profiler.init_app(app)
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -30,14 +119,16 @@ class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))
     is_admin = db.Column(db.Boolean, default=False)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        """Hash on the password pool. Raises HasherBusy when it is saturated."""
+        self.password_hash = password_hasher.hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify on the password pool. Raises HasherBusy when it is saturated."""
+        return password_hasher.verify(self.password_hash, password)
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,27 +140,156 @@ class Product(db.Model):
     
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Lookups by user_id use the leading column of the unique index below
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
     user = db.relationship('User', backref=db.backref('cart_items', lazy=True))
     product = db.relationship('Product')
+    
+    # One row per product: add_to_cart upserts against this constraint
+    __table_args__ = (db.UniqueConstraint('user_id', 'product_id', name='uq_cart_item_user_product'),)
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    date_ordered = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    date_ordered = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     complete = db.Column(db.Boolean, default=False)
     user = db.relationship('User', backref=db.backref('orders', lazy=True))
     
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
     order = db.relationship('Order', backref=db.backref('items', lazy=True))
     product = db.relationship('Product')
 
+# Order total computed in SQL as part of the order query itself
+Order.total = db.column_property(
+    db.select(db.func.coalesce(db.func.sum(OrderItem.quantity * Product.price), 0))
+    .where(OrderItem.order_id == Order.id)
+    .where(OrderItem.product_id == Product.id)
+    .correlate_except(OrderItem, Product)
+    .scalar_subquery()
+)
+
+def _product_snapshot(product):
+    """Plain, session-independent copy of a product that is safe to cache."""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'price': product.price,
+        'stock': product.stock,
+        'image': product.image
+    }
+
+def get_catalog():
+    """All products, served from the catalog cache."""
+    return catalog_cache.get('products', lambda: [_product_snapshot(p) for p in Product.query.all()])
+
+def get_catalog_product(product_id):
+    """One product from the catalog cache, or None if it does not exist."""
+    def load():
+        product = db.session.get(Product, product_id)
+        return _product_snapshot(product) if product else None
+    return catalog_cache.get(('product', product_id), load)
+
+def cached_page(render):
+    """
+    Serve a page from the page cache with a strong ETag, answering 304 when
+    If-None-Match matches.
+    
+    Only anonymous requests without pending flash messages are cached, since
+    those are the only ones whose HTML depends on nothing but the route,
+    its arguments and the catalog. Tracking decorators and events in the
+    view still run on every hit.
+    """
+    if current_user.is_authenticated or session.get('_flashes'):
+        return render()
+    
+    version = catalog_cache.version
+    key = (request.endpoint, tuple(sorted(request.view_args.items())), tuple(sorted(request.args.items(multi=True))))
+    entry = page_cache.get(key, version)
+    if entry is None:
+        body = render()
+        entry = page_cache.set(key, version, (body, strong_etag(body)))
+    
+    body, etag = entry
+    response = make_response(body)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def product_grid():
+    """Product grid fragment, cached per catalog version and login state."""
+    version = catalog_cache.version
+    key = ('product_grid', current_user.is_authenticated)
+    html = fragment_cache.get(key, version)
+    if html is None:
+        html = fragment_cache.set(key, version, render_template('_product_grid.html', products=get_catalog()))
+    return Markup(html)
+
+# Fingerprinted static assets written by `flask build-assets`
+ASSET_OUTPUT = ASSET_CONFIG.get('output', 'dist')
+asset_manifest = AssetManifest(os.path.join(app.static_folder, ASSET_OUTPUT, 'manifest.json'))
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Point url_for('static', filename=...) at the fingerprinted copy when there is one."""
+    if endpoint == 'static' and 'filename' in values:
+        hashed = asset_manifest.lookup(values['filename'])
+        if hashed:
+            values['filename'] = f"{ASSET_OUTPUT}/{hashed}"
+
+def serve_static(filename):
+    """Static files: fingerprinted copies precompressed and cached forever, the rest as before."""
+    if filename.startswith(ASSET_OUTPUT + '/'):
+        return send_precompressed(app.static_folder, filename, ASSET_CONFIG.get('max_age', 31536000))
+    return app.send_static_file(filename)
+
+app.view_functions['static'] = serve_static
+
+@app.template_global()
+def image_url(image, variant='full', fmt='jpg'):
+    """URL of a product image variant, falling back to the original or the placeholder."""
+    if not image:
+        return url_for('static', filename='images/placeholder.jpg')
+    name = image_pipeline.variant_name(image, variant, fmt)
+    if name is None:
+        # Image stored before the pipeline existed
+        return url_for('static', filename='images/' + image)
+    return url_for('media', filename=name)
+
+@app.template_global()
+def image_srcset(image, fmt='jpg'):
+    """srcset value listing every variant of a product image, or '' if there are none."""
+    if not image:
+        return ''
+    return ', '.join(f"{url_for('media', filename=name)} {width}w"
+                     for name, width in image_pipeline.srcset_entries(image, fmt))
+
+@app.template_global()
+def cart_count():
+    """Items in the current user's cart for the navbar, cached in the session until the cart changes."""
+    if not current_user.is_authenticated:
+        return 0
+    if 'cart_count' not in session:
+        count = (db.session.query(func.coalesce(func.sum(CartItem.quantity), 0))
+                 .filter(CartItem.user_id == current_user.id)
+                 .scalar())
+        session['cart_count'] = int(count)
+    return session['cart_count']
+
+def save_product_image(upload):
+    """Store an uploaded product image, returning its stored name or None if rejected."""
+    name = image_pipeline.save_upload(upload.read(), upload.filename)
+    if name is None:
+        flash('Unsupported image type. Please upload a JPEG, PNG, GIF or WebP file.')
+    return name
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -77,19 +297,44 @@ def load_user(user_id):
 # GTM Server-Side Routes
 @app.route('/collect', methods=['POST'])
 def gtm_collect():
-    """Endpoint for Google Tag Manager server-side data collection"""
+    """Endpoint for Google Tag Manager server-side data collection.
+    
+    Accepts a single JSON event, a JSON array or {"events": [...]} object, or
+    newline-delimited JSON (application/x-ndjson) streamed line by line.
+    """
+    # JSON bodies are parsed whole; larger batches must be streamed as NDJSON
+    if (request.mimetype not in ('application/x-ndjson', 'application/jsonl')
+            and (request.content_length or 0) > collector.max_body_bytes):
+        return make_response(jsonify({'error': 'body too large, send NDJSON to stream larger batches'}), 413)
+    
     try:
-        # Get the request data
-        payload = request.get_json(silent=True) or {}
-        
-        # Log the event data for debugging
-        app.logger.info(f"GTM Collect: {json.dumps(payload)}")
-        
-        # Return a success response (204 No Content is typical for tracking endpoints)
-        return make_response('', 204)
+        result = collector.ingest(request.stream, request.mimetype, request.remote_addr)
     except Exception as e:
         app.logger.error(f"Error processing GTM data: {str(e)}")
         return make_response(jsonify({'error': str(e)}), 500)
+    
+    # 204 No Content is typical for tracking endpoints when everything was accepted
+    if not result['rejected'] and not result['rate_limited']:
+        return make_response('', 204)
+    
+    if result['rate_limited']:
+        status = 429
+    elif not result['accepted']:
+        status = 400
+    else:
+        status = 200
+    return make_response(jsonify(result), status)
+
+# Tabs on the debug interface: (element id, title, event name or None for all, css class)
+DEBUG_TABS = [
+    ('AllEvents', 'All Events', None, ''),
+    ('PageViews', 'Page Views', 'page_view', 'page-view'),
+    ('ProductViews', 'Product Views', 'view_item', 'product-view'),
+    ('AddToCart', 'Add to Cart', 'add_to_cart', 'add-to-cart'),
+    ('Logouts', 'User Logouts', 'user_logout', 'user-logout'),
+]
+DEBUG_TAB_LIMIT = 10
+DEBUG_ALL_LIMIT = 20
 
 @app.route('/gtm/debug', methods=['GET'])
 def gtm_debug():
@@ -102,154 +347,127 @@ def gtm_debug():
     # Log the debug request
     app.logger.info(f"GTM Debug accessed: ID={gtm_id}, Auth={gtm_auth}, Preview={gtm_preview}")
     
-    # Get recent events of each type
-    page_views = gtm.get_recent_events(event_type='page_view', limit=10)
-    product_views = gtm.get_recent_events(event_type='view_item', limit=10)
-    add_to_cart_events = gtm.get_recent_events(event_type='add_to_cart', limit=10)
-    logouts = gtm.get_recent_events(event_type='user_logout', limit=10)
-    all_events = gtm.get_recent_events(limit=20)
-    
-    debug_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>GTM Debug Interface</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; }}
-            h1, h2, h3 {{ color: #333; }}
-            .container {{ max-width: 1000px; margin: 0 auto; }}
-            .info {{ background: #f4f4f4; padding: 15px; border-radius: 5px; margin-bottom: 20px; }}
-            .param {{ margin-bottom: 10px; }}
-            .key {{ font-weight: bold; }}
-            .event {{ background: #fff; padding: 10px; margin: 10px 0; border-left: 3px solid #ccc; border-radius: 3px; }}
-            .event-time {{ color: #666; font-size: 0.9em; }}
-            .event-name {{ font-weight: bold; color: #2c3e50; }}
-            .event-data {{ margin-top: 5px; font-family: monospace; white-space: pre-wrap; font-size: 0.8em; max-height: 100px; overflow-y: auto; }}
-            .page-view {{ border-left-color: #3498db; }}
-            .product-view {{ border-left-color: #2ecc71; }}
-            .add-to-cart {{ border-left-color: #e74c3c; }}
-            .user-logout {{ border-left-color: #f39c12; }}
-            .tab {{ overflow: hidden; border: 1px solid #ccc; background-color: #f1f1f1; }}
-            .tab button {{ background-color: inherit; float: left; border: none; outline: none; cursor: pointer; padding: 14px 16px; transition: 0.3s; }}
-            .tab button:hover {{ background-color: #ddd; }}
-            .tab button.active {{ background-color: #ccc; }}
-            .tabcontent {{ display: none; padding: 6px 12px; border: 1px solid #ccc; border-top: none; }}
-            #AllEvents {{ display: block; }}
-        </style>
-        <script>
-            function openEventTab(evt, tabName) {{
-                var i, tabcontent, tablinks;
-                tabcontent = document.getElementsByClassName("tabcontent");
-                for (i = 0; i < tabcontent.length; i++) {{
-                    tabcontent[i].style.display = "none";
-                }}
-                tablinks = document.getElementsByClassName("tablinks");
-                for (i = 0; i < tablinks.length; i++) {{
-                    tablinks[i].className = tablinks[i].className.replace(" active", "");
-                }}
-                document.getElementById(tabName).style.display = "block";
-                evt.currentTarget.className += " active";
-            }}
-            
-            // Auto-reload the page every 10 seconds
-            setTimeout(function() {{
-                location.reload();
-            }}, 10000);
-        </script>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Google Tag Manager Debug Interface</h1>
-            <div class="info">
-                <div class="param"><span class="key">Container ID:</span> {gtm_id or GTM_CONFIG['container_id']}</div>
-                <div class="param"><span class="key">Auth:</span> {gtm_auth or 'Not provided'}</div>
-                <div class="param"><span class="key">Preview Mode:</span> {gtm_preview or 'Not active'}</div>
-            </div>
-            
-            <h2>Active Configuration</h2>
-            <div class="info">
-                <div class="param"><span class="key">Server URL:</span> {GTM_CONFIG['server_url']}</div>
-                <div class="param"><span class="key">Container ID:</span> {GTM_CONFIG['container_id']}</div>
-                <div class="param"><span class="key">API Secret Set:</span> {'Yes' if GTM_CONFIG.get('api_secret') else 'No'}</div>
-                <div class="param"><span class="key">Container Config Available:</span> {'Yes' if GTM_CONFIG.get('container_config') else 'No'}</div>
-            </div>
-            
-            <h2>Recent Events</h2>
-            <div class="tab">
-                <button class="tablinks active" onclick="openEventTab(event, 'AllEvents')">All Events ({len(all_events)})</button>
-                <button class="tablinks" onclick="openEventTab(event, 'PageViews')">Page Views ({len(page_views)})</button>
-                <button class="tablinks" onclick="openEventTab(event, 'ProductViews')">Product Views ({len(product_views)})</button>
-                <button class="tablinks" onclick="openEventTab(event, 'AddToCart')">Add to Cart ({len(add_to_cart_events)})</button>
-                <button class="tablinks" onclick="openEventTab(event, 'Logouts')">User Logouts ({len(logouts)})</button>
-            </div>
-            
-            <div id="AllEvents" class="tabcontent">
-                <h3>All Recent Events</h3>
-                {''.join([f"""
-                <div class="event {'page-view' if e['event_name'] == 'page_view' else 'product-view' if e['event_name'] == 'view_item' else 'add-to-cart' if e['event_name'] == 'add_to_cart' else 'user-logout' if e['event_name'] == 'user_logout' else ''}">
-                    <div class="event-time">{e['timestamp']}</div>
-                    <div class="event-name">{e['event_name']}</div>
-                    <div class="event-data">{json.dumps(e['data'], indent=2)}</div>
-                </div>
-                """ for e in all_events]) or "<p>No events recorded yet</p>"}
-            </div>
-            
-            <div id="PageViews" class="tabcontent">
-                <h3>Page View Events</h3>
-                {''.join([f"""
-                <div class="event page-view">
-                    <div class="event-time">{e['timestamp']}</div>
-                    <div class="event-name">{e['event_name']}</div>
-                    <div class="event-data">{json.dumps(e['data'], indent=2)}</div>
-                </div>
-                """ for e in page_views]) or "<p>No page view events recorded yet</p>"}
-            </div>
-            
-            <div id="ProductViews" class="tabcontent">
-                <h3>Product View Events</h3>
-                {''.join([f"""
-                <div class="event product-view">
-                    <div class="event-time">{e['timestamp']}</div>
-                    <div class="event-name">{e['event_name']}</div>
-                    <div class="event-data">{json.dumps(e['data'], indent=2)}</div>
-                </div>
-                """ for e in product_views]) or "<p>No product view events recorded yet</p>"}
-            </div>
-            
-            <div id="AddToCart" class="tabcontent">
-                <h3>Add to Cart Events</h3>
-                {''.join([f"""
-                <div class="event add-to-cart">
-                    <div class="event-time">{e['timestamp']}</div>
-                    <div class="event-name">{e['event_name']}</div>
-                    <div class="event-data">{json.dumps(e['data'], indent=2)}</div>
-                </div>
-                """ for e in add_to_cart_events]) or "<p>No add to cart events recorded yet</p>"}
-            </div>
-            
-            <div id="Logouts" class="tabcontent">
-                <h3>User Logout Events</h3>
-                {''.join([f"""
-                <div class="event user-logout">
-                    <div class="event-time">{e['timestamp']}</div>
-                    <div class="event-name">{e['event_name']}</div>
-                    <div class="event-data">{json.dumps(e['data'], indent=2)}</div>
-                </div>
-                """ for e in logouts]) or "<p>No user logout events recorded yet</p>"}
-            </div>
-        </div>
-    </body>
-    </html>
+    # Recent events of each type, merged so every event is embedded (and encoded) once
+    events = {e['seq']: e for e in gtm.get_recent_events(limit=DEBUG_ALL_LIMIT)}
+    for _, _, event_name, _ in DEBUG_TABS:
+        if event_name:
+            events.update((e['seq'], e) for e in gtm.get_recent_events(event_type=event_name, limit=DEBUG_TAB_LIMIT))
+    initial_events = Markup('[' + ','.join(encode_record(events[seq]) for seq in sorted(events)) + ']')
+    
+    return render_template(
+        'gtm/debug.html',
+        container_id=gtm_id or GTM_CONFIG['container_id'],
+        gtm_auth=gtm_auth,
+        gtm_preview=gtm_preview,
+        gtm_config=GTM_CONFIG,
+        pool_stats=gtm.delivery_stats()['http'],
+        sql_profile=sql_profiler.summary() if sql_profiler else None,
+        tabs=DEBUG_TABS,
+        tab_limit=DEBUG_TAB_LIMIT,
+        all_limit=DEBUG_ALL_LIMIT,
+        initial_events=initial_events,
+        cursor=max(events) if events else -1
+    )
+
+@app.route('/gtm/debug/events', methods=['GET'])
+def gtm_debug_events():
+    """Events recorded after ?since=<seq>, for the debug interface to poll.
+    
+    "missed" counts events that dropped out of the history before they could
+    be returned. "more" is true when the page was full and the client should
+    poll again straight away.
     """
+    since = request.args.get('since', -1, type=int)
+    limit = max(min(request.args.get('limit', 100, type=int), gtm.max_history_size), 1)
+    events, missed = gtm.get_events_since(since, limit)
+    cursor = events[-1]['seq'] if events else since + missed
+    body = '{"cursor":%d,"missed":%d,"more":%s,"events":[%s]}' % (
+        cursor, missed, 'true' if len(events) >= limit else 'false', ','.join(encode_record(e) for e in events))
+    return Response(body, mimetype='application/json')
+
+@app.route('/media/<path:filename>')
+def media(filename):
+    """Product images. Names are content hashes, so responses never change."""
+    max_age = IMAGE_CONFIG.get('max_age', 31536000)
+    response = send_from_directory(image_pipeline.directory, filename, max_age=max_age)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Counters and latency histograms in Prometheus text exposition format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/gtm/stream', methods=['GET'])
+def gtm_stream():
+    """Server-Sent Events stream of tracked events.
+    
+    ?event=<name> (repeatable) filters by event name. Reconnecting clients
+    resume after their Last-Event-ID (or ?since=<seq>) from the event history;
+    if some of the events after it have already dropped out of the history,
+    an "event: gap" frame says how many.
+    """
+    stream_config = GTM_CONFIG.get('stream', {})
+    keepalive = stream_config.get('keepalive_seconds', 15)
+    event_names = request.args.getlist('event') or None
+    since = request.headers.get('Last-Event-ID', request.args.get('since', type=int), type=int)
+    
+    # Subscribe before reading the backlog so no event falls in between
+    subscription = gtm.subscribe(event_names, stream_config.get('max_buffer', 100))
+    backlog = []
+    missed = 0
+    if since is not None:
+        cursor = since
+        while True:
+            events, dropped = gtm.get_events_since(cursor, 500)
+            missed += dropped
+            if not events:
+                break
+            backlog.extend(events)
+            cursor = events[-1]['seq']
+    
+    def frame(record):
+        return f"id: {record['seq']}\ndata: {encode_record(record)}\n\n"
+    
+    def generate():
+        try:
+            yield "retry: 2000\n\n"
+            if missed:
+                yield 'event: gap\ndata: {"missed":%d}\n\n' % missed
+            last_seq = since if since is not None else -1
+            for record in backlog:
+                if event_names is None or record['event_name'] in event_names:
+                    yield frame(record)
+                last_seq = record['seq']
+            while True:
+                events = subscription.get(timeout=keepalive)
+                if events is None:
+                    yield "event: evicted\ndata: {}\n\n"
+                    return
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                for record in events:
+                    if record['seq'] > last_seq:
+                        yield frame(record)
+        finally:
+            subscription.close()
     
-    return debug_html
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 # Routes
 @app.route('/')
 @track_pageview(gtm)
 def home():
-    products = Product.query.all()
-    return render_template('index.html', products=products)
+    return cached_page(lambda: render_template('index.html', product_grid=product_grid()))
+
+def too_busy(body):
+    """503 asking the client to retry shortly, for when the password pool is saturated."""
+    return make_response(body, 503, {'Retry-After': '5'})
 
 @app.route('/register', methods=['GET', 'POST'])
 @track_pageview(gtm)
@@ -272,7 +490,11 @@ def register():
             
         # Create new user
         user = User(username=username, email=email)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except HasherBusy:
+            flash('We are handling a lot of sign-ups right now. Please try again in a moment.')
+            return too_busy(render_template('register.html'))
         
         # First user is admin
         if User.query.count() == 0:
@@ -294,13 +516,38 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        
+        # Turn floods away before doing any hashing
+        if not login_limiter.allow(request.remote_addr, username):
+            LOGIN_ATTEMPTS.inc(outcome='throttled')
+            flash('Too many login attempts. Please wait a minute and try again.')
+            return make_response(render_template('login.html'), 429, {'Retry-After': '60'})
+        
         user = User.query.filter_by(username=username).first()
+        try:
+            valid = user is not None and user.check_password(password)
+        except HasherBusy:
+            LOGIN_ATTEMPTS.inc(outcome='busy')
+            flash('We are handling a lot of logins right now. Please try again in a moment.')
+            return too_busy(render_template('login.html'))
         
-        if user and user.check_password(password):
+        if valid:
+            LOGIN_ATTEMPTS.inc(outcome='success')
+            login_limiter.succeeded(request.remote_addr, username)
+            if password_hasher.needs_rehash(user.password_hash):
+                # Hash parameters changed since this password was stored
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except HasherBusy:
+                    pass
             login_user(user)
+            session.pop('cart_count', None)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('home'))
         else:
+            LOGIN_ATTEMPTS.inc(outcome='failure')
+            login_limiter.failed(request.remote_addr, username)
             flash('Invalid username or password')
             
     return render_template('login.html')
@@ -310,57 +557,70 @@ def login():
 def logout():
     gtm.send_event('user_logout')
     logout_user()
+    session.pop('cart_count', None)
     return redirect(url_for('home'))
 
 @app.route('/product/<int:product_id>')
 @track_pageview(gtm)
 def product(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = get_catalog_product(product_id)
+    if product is None:
+        abort(404)
     
     # Track product view event
     gtm.send_event('view_item', {
         'items': [{
-            'item_id': product.id,
-            'item_name': product.name,
-            'price': product.price
+            'item_id': product['id'],
+            'item_name': product['name'],
+            'price': product['price']
         }]
     })
     
-    return render_template('product.html', product=product)
+    return cached_page(lambda: render_template('product.html', product=product))
 
 @app.route('/cart')
 @login_required
 @track_pageview(gtm)
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    # Items, cart total and item count in one round trip: the window sums
+    # repeat the totals on every row
+    cart_items = (db.session.query(CartItem.id, CartItem.quantity,
+                                   Product.id.label('product_id'), Product.name, Product.price, Product.image,
+                                   (CartItem.quantity * Product.price).label('subtotal'),
+                                   func.sum(CartItem.quantity * Product.price).over().label('total'),
+                                   func.sum(CartItem.quantity).over().label('item_count'))
+                  .join(Product, CartItem.product_id == Product.id)
+                  .filter(CartItem.user_id == current_user.id)
+                  .order_by(CartItem.id)
+                  .all())
+    total = cart_items[0].total if cart_items else 0
+    session['cart_count'] = int(cart_items[0].item_count) if cart_items else 0
     return render_template('cart.html', cart_items=cart_items, total=total)
 
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_cart(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = get_catalog_product(product_id)
+    if product is None:
+        abort(404)
     quantity = int(request.form.get('quantity', 1))
     
-    # Check if item already in cart
-    cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first()
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(user_id=current_user.id, product_id=product_id, quantity=quantity)
-        db.session.add(cart_item)
-        
+    # Insert the item or add to its quantity in one statement, so concurrent
+    # requests (double clicks, several tabs) neither duplicate nor lose it
+    upsert_increment(db.session, CartItem, {'user_id': current_user.id, 'product_id': product_id},
+                     'quantity', quantity)
     db.session.commit()
+    session.pop('cart_count', None)
     
     # Track add to cart event
     gtm.track_add_to_cart(
-        item_id=product.id,
-        item_name=product.name,
-        price=product.price,
+        item_id=product['id'],
+        item_name=product['name'],
+        price=product['price'],
         quantity=quantity
     )
     
-    flash(f'Added {product.name} to your cart!')
+    flash(f"Added {product['name']} to your cart!")
     return redirect(url_for('cart'))
 
 @app.route('/remove_from_cart/<int:item_id>')
@@ -373,48 +633,82 @@ def remove_from_cart(item_id):
         
     db.session.delete(cart_item)
     db.session.commit()
+    session.pop('cart_count', None)
     flash('Item removed from cart')
     return redirect(url_for('cart'))
 
 @app.route('/checkout')
 @login_required
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    if not cart_items:
+    # One joined query for the cart and the product details needed for tracking.
+    # Ordered by product so concurrent checkouts lock rows in the same order.
+    cart_rows = (db.session.query(CartItem.id, CartItem.product_id, CartItem.quantity,
+                                  Product.name, Product.price)
+                 .join(Product, CartItem.product_id == Product.id)
+                 .filter(CartItem.user_id == current_user.id)
+                 .order_by(CartItem.product_id)
+                 .all())
+    if not cart_rows:
         flash('Your cart is empty')
         return redirect(url_for('cart'))
-        
-    # Create order
-    order = Order(user_id=current_user.id)
-    db.session.add(order)
-    
-    # Prepare for GTM tracking
-    order_items = []
-    order_total = 0
     
-    # Add items to order
-    for item in cart_items:
-        order_item = OrderItem(order_id=order.id, product_id=item.product_id, quantity=item.quantity)
-        db.session.add(order_item)
+    try:
+        # Claim the cart first: a second checkout of the same cart submitted
+        # at the same time reads the same rows, but only one transaction can
+        # delete them. The loser finds fewer rows than it read and backs out
+        # before touching stock or creating an order.
+        claimed = db.session.execute(
+            db.delete(CartItem)
+            .where(CartItem.id.in_([row.id for row in cart_rows]))
+            .execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount != len(cart_rows):
+            db.session.rollback()
+            session.pop('cart_count', None)
+            flash('Your cart changed while checking out. Please review it and try again.')
+            return redirect(url_for('cart'))
         
-        # Update product stock
-        product = item.product
-        product.stock -= item.quantity
+        # Reserve stock with a conditional decrement: the UPDATE only matches
+        # while enough stock is left, so concurrent checkouts cannot oversell
+        for row in cart_rows:
+            reserved = db.session.execute(
+                db.update(Product)
+                .where(Product.id == row.product_id, Product.stock >= row.quantity)
+                .values(stock=Product.stock - row.quantity)
+                .execution_options(synchronize_session=False)
+            )
+            if reserved.rowcount != 1:
+                db.session.rollback()
+                flash(f'Sorry, there is not enough stock left for {row.name}. Please update your cart.')
+                return redirect(url_for('cart'))
         
-        # Add to tracking data
-        order_items.append({
-            'item_id': str(product.id),
-            'item_name': product.name,
-            'price': product.price,
-            'quantity': item.quantity
-        })
-        order_total += product.price * item.quantity
+        # Create order; flush assigns order.id for the order items
+        order = Order(user_id=current_user.id, complete=True)
+        db.session.add(order)
+        db.session.flush()
         
-        # Remove from cart
-        db.session.delete(item)
-        
-    order.complete = True
-    db.session.commit()
+        # Add items to order in one bulk insert
+        db.session.execute(db.insert(OrderItem), [
+            {'order_id': order.id, 'product_id': row.product_id, 'quantity': row.quantity}
+            for row in cart_rows
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    # Stock changed
+    catalog_cache.invalidate()
+    session['cart_count'] = 0
+    
+    # Prepare for GTM tracking
+    order_items = [{
+        'item_id': str(row.product_id),
+        'item_name': row.name,
+        'price': row.price,
+        'quantity': row.quantity
+    } for row in cart_rows]
+    order_total = sum(row.price * row.quantity for row in cart_rows)
     
     # Track purchase event
     gtm.track_purchase(
@@ -429,10 +723,26 @@ def checkout():
 @app.route('/orders')
 @login_required
 def orders():
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.date_ordered.desc()).all()
+    orders = (Order.query
+              .options(selectinload(Order.items).joinedload(OrderItem.product))
+              .filter_by(user_id=current_user.id)
+              .order_by(Order.date_ordered.desc())
+              .all())
     return render_template('orders.html', orders=orders)
 
 # Admin routes
+def _page_size():
+    """Page size for admin listings, from ?limit= within the configured bounds."""
+    limit = request.args.get('limit', app.config['ADMIN_PAGE_SIZE'], type=int)
+    return max(1, min(limit, app.config['ADMIN_MAX_PAGE_SIZE']))
+
+def _render_listing(template, **context):
+    """Render an admin listing, streaming it to the client when ?stream=1 is set."""
+    if request.args.get('stream'):
+        # stream_template wraps the generator in stream_with_context
+        return Response(stream_template(template, **context))
+    return render_template(template, **context)
+
 @app.route('/admin')
 @login_required
 def admin():
@@ -449,8 +759,22 @@ def admin_products():
         flash('Access denied: Admin privileges required')
         return redirect(url_for('home'))
         
-    products = Product.query.all()
-    return render_template('admin/products.html', products=products)
+    products, next_cursor = keyset_paginate(Product.query, [Product.id],
+                                            after=request.args.get('after'), limit=_page_size())
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'products': [{
+                'id': p.id,
+                'name': p.name,
+                'description': p.description,
+                'price': p.price,
+                'stock': p.stock,
+                'image': p.image
+            } for p in products],
+            'next_cursor': next_cursor
+        })
+    return _render_listing('admin/products.html', products=products, next_cursor=next_cursor)
 
 @app.route('/admin/add_product', methods=['GET', 'POST'])
 @login_required
@@ -471,12 +795,11 @@ def add_product():
         if 'image' in request.files:
             image = request.files['image']
             if image.filename:
-                filename = f"{name.lower().replace(' ', '_')}.jpg"
-                image.save(os.path.join(app.root_path, 'static/images', filename))
-                product.image = filename
+                product.image = save_product_image(image)
                 
         db.session.add(product)
         db.session.commit()
+        catalog_cache.invalidate()
         flash('Product added successfully!')
         return redirect(url_for('admin_products'))
         
@@ -499,12 +822,10 @@ def edit_product(product_id):
         
         # Handle image upload
         if 'image' in request.files and request.files['image'].filename:
-            image = request.files['image']
-            filename = f"{product.name.lower().replace(' ', '_')}.jpg"
-            image.save(os.path.join(app.root_path, 'static/images', filename))
-            product.image = filename
+            product.image = save_product_image(request.files['image']) or product.image
             
         db.session.commit()
+        catalog_cache.invalidate()
         flash('Product updated successfully!')
         return redirect(url_for('admin_products'))
         
@@ -520,6 +841,7 @@ def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     db.session.delete(product)
     db.session.commit()
+    catalog_cache.invalidate()
     flash('Product deleted successfully!')
     return redirect(url_for('admin_products'))
 
@@ -530,8 +852,33 @@ def admin_users():
         flash('Access denied: Admin privileges required')
         return redirect(url_for('home'))
         
-    users = User.query.all()
-    return render_template('admin/users.html', users=users)
+    users, next_cursor = keyset_paginate(User.query, [User.id],
+                                         after=request.args.get('after'), limit=_page_size())
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'users': [{
+                'id': u.id,
+                'username': u.username,
+                'email': u.email,
+                'is_admin': u.is_admin
+            } for u in users],
+            'next_cursor': next_cursor
+        })
+    return _render_listing('admin/users.html', users=users, next_cursor=next_cursor)
+
+@app.route('/admin/cache_stats')
+@login_required
+def admin_cache_stats():
+    if not current_user.is_admin:
+        flash('Access denied: Admin privileges required')
+        return redirect(url_for('home'))
+    
+    return jsonify({
+        'catalog': catalog_cache.stats(),
+        'pages': page_cache.stats(),
+        'fragments': fragment_cache.stats()
+    })
 
 @app.route('/admin/toggle_admin/<int:user_id>')
 @login_required
@@ -553,12 +900,37 @@ def admin_orders():
         flash('Access denied: Admin privileges required')
         return redirect(url_for('home'))
         
-    orders = Order.query.order_by(Order.date_ordered.desc()).all()
-    return render_template('admin/orders.html', orders=orders)
+    query = Order.query.options(joinedload(Order.user),
+                                selectinload(Order.items).joinedload(OrderItem.product))
+    orders, next_cursor = keyset_paginate(query, [Order.date_ordered, Order.id],
+                                          after=request.args.get('after'), limit=_page_size(),
+                                          descending=True)
+    
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'orders': [{
+                'id': o.id,
+                'user_id': o.user_id,
+                'username': o.user.username,
+                'date_ordered': o.date_ordered.isoformat(),
+                'complete': o.complete,
+                'total': o.total,
+                'items': [{
+                    'product_id': item.product_id,
+                    'name': item.product.name,
+                    'price': item.product.price,
+                    'quantity': item.quantity
+                } for item in o.items]
+            } for o in orders],
+            'next_cursor': next_cursor
+        })
+    return _render_listing('admin/orders.html', orders=orders, next_cursor=next_cursor)
 
 # Initialize the database
-with app.app_context():
+def init_db():
+    """Create tables, apply pending migrations and seed an admin user and sample products into an empty database."""
     db.create_all()
+    run_migrations(db.engine)
     
     # Create admin user if no users exist
     if User.query.count() == 0:
@@ -575,6 +947,18 @@ with app.app_context():
         db.session.add_all(products)
         db.session.commit()
 
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files (run once per deploy, then restart)."""
+    manifest = build_assets(app.static_folder, ASSET_OUTPUT, exclude=ASSET_CONFIG.get('exclude', ('media',)))
+    print(f"Built {len(manifest)} assets into {os.path.join(app.static_folder, ASSET_OUTPUT)}")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database schema and seed data (run once per deploy)."""
+    init_db()
+    print("Database initialized")
+
 if __name__ == "__main__":
     # For development
     # app.run(host="0.0.0.0", port=5015, debug=True)
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('gtm_server')
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.map')
+
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprinted_name(path, content):
+    """style.css -> style.<hash>.css, using a prefix of the content's SHA-256."""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{digest}{ext}"
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_assets(static_dir, output='dist', exclude=('media',), min_bytes=256):
+    """
+    Copy every static file to <output>/ under a content-hashed name, with
+    precompressed .gz (and, when the brotli package is installed, .br)
+    siblings for text assets, and write <output>/manifest.json mapping
+    original paths to fingerprinted ones.
+
+    Compressed siblings are only kept when they are smaller than the file.
+    Files from earlier builds are left in place so pages still referencing
+    them keep working.
+
+    Args:
+        static_dir (str): The app's static folder
+        output (str): Output directory, relative to static_dir
+        exclude (iterable): Top-level directories of static_dir to skip
+        min_bytes (int): Files smaller than this are not compressed
+
+    Returns:
+        dict: The manifest
+    """
+    if brotli is None:
+        logger.warning("brotli is not installed, writing .gz assets only")
+    skip = {output, *exclude}
+    output_dir = os.path.join(static_dir, output)
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_dir):
+        rel_root = os.path.relpath(root, static_dir)
+        if rel_root == '.':
+            dirs[:] = sorted(d for d in dirs if d not in skip)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            rel_path = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                content = f.read()
+
+            hashed = fingerprinted_name(rel_path, content)
+            target = os.path.join(output_dir, hashed)
+            manifest[rel_path] = hashed
+            if os.path.exists(target):
+                continue
+            _write(target, content)
+
+            if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS) or len(content) < min_bytes:
+                continue
+            compressed = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(compressed) < len(content):
+                _write(target + '.gz', compressed)
+            if brotli is not None:
+                compressed = brotli.compress(content, quality=11)
+                if len(compressed) < len(content):
+                    _write(target + '.br', compressed)
+
+    _write(os.path.join(output_dir, 'manifest.json'),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, path):
+        """
+        Mapping of static paths to their fingerprinted copies, as written by
+        build_assets. A missing manifest maps nothing, so static files are
+        served as they are until `flask build-assets` has been run.
+
+        Args:
+            path (str): Location of manifest.json
+        """
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError as e:
+            logger.error(f"Ignoring unreadable asset manifest {self.path}: {str(e)}")
+            self.entries = {}
+
+    def lookup(self, filename):
+        """Fingerprinted path for a static file, or None if it is not in the manifest."""
+        return self.entries.get(filename)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def send_precompressed(directory, filename, max_age=31536000):
+    """
+    Serve a fingerprinted asset, choosing its .br or .gz sibling when the
+    client accepts that encoding, with far-future immutable caching.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    content_encoding = None
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings.quality(encoding) > 0 and os.path.isfile(path + suffix):
+            filename, content_encoding = filename + suffix, encoding
+            break
+
+    response = send_from_directory(directory, filename, mimetype=mimetype, max_age=max_age)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
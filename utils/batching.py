@@ -0,0 +1,158 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('gtm_server')
+
+
+class EventBatcher:
+    def __init__(self, send_batch, max_events=25, max_bytes=64 * 1024, max_wait_ms=250,
+                 on_result=None, encode=None):
+        """
+        Collect prepared events and deliver them as one payload per flush.
+
+        A flush happens when the batch reaches max_events events, max_bytes of
+        encoded JSON, or when the oldest event has waited max_wait_ms,
+        whichever comes first. Size-triggered flushes are sent on the thread
+        that added the event; time-triggered flushes on a background thread.
+
+        Args:
+            send_batch (callable): Called as send_batch(body, events) with the encoded
+                JSON body and the list of (event_name, prepared_data) it contains.
+                Must return a list with one bool per event.
+            max_events (int): Maximum events per batch
+            max_bytes (int): Maximum encoded payload size per batch
+            max_wait_ms (int): Maximum time an event may wait before being flushed
+            on_result (callable, optional): Called as on_result(event_name, prepared_data, ok)
+                for every event once its batch has been sent
+            encode (callable, optional): Encodes one prepared event to JSON bytes,
+                defaults to compact json.dumps
+        """
+        self.send_batch = send_batch
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait_ms / 1000.0
+        self.on_result = on_result
+        self.encode = encode or self._encode
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._events = []
+        self._encoded = []
+        self._size = 0
+        self._deadline = None
+        self._closed = False
+
+        self.batches_sent = 0
+        self.events_sent = 0
+        self.events_failed = 0
+
+        self._flusher = threading.Thread(target=self._run, name="gtm-batch-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _encode(prepared_data):
+        return json.dumps(prepared_data, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def build_body(encoded_events):
+        """Join pre-encoded events into a single batch payload without re-encoding them."""
+        return b'{"events":[' + b','.join(encoded_events) + b']}'
+
+    def add(self, event_name, prepared_data):
+        """
+        Add a prepared event to the current batch.
+
+        Returns:
+            bool: True once the event is accepted (delivery is reported via on_result)
+        """
+        encoded = self.encode(prepared_data)
+        batch = None
+        with self._lock:
+            # Start a fresh batch if this event would push the payload over max_bytes
+            if self._events and self._size + len(encoded) + 1 > self.max_bytes:
+                batch = self._take()
+            if not self._events:
+                self._deadline = time.monotonic() + self.max_wait
+                self._wakeup.notify()
+            self._events.append((event_name, prepared_data))
+            self._encoded.append(encoded)
+            self._size += len(encoded) + 1
+            full = len(self._events) >= self.max_events or self._size >= self.max_bytes
+
+        if batch:
+            self._send(*batch)
+        if full:
+            self.flush()
+        return True
+
+    def _take(self):
+        """Detach the pending batch. Caller must hold the lock."""
+        batch = (self._events, self._encoded)
+        self._events, self._encoded, self._size, self._deadline = [], [], 0, None
+        return batch
+
+    def flush(self):
+        """Send whatever is currently pending."""
+        with self._lock:
+            if not self._events:
+                return
+            batch = self._take()
+        self._send(*batch)
+
+    def _send(self, events, encoded):
+        try:
+            results = self.send_batch(self.build_body(encoded), events)
+        except Exception as e:
+            logger.error(f"Exception while sending batch of {len(events)} events: {str(e)}")
+            results = [False] * len(events)
+
+        with self._lock:
+            self.batches_sent += 1
+            for ok in results:
+                if ok:
+                    self.events_sent += 1
+                else:
+                    self.events_failed += 1
+
+        for (event_name, prepared_data), ok in zip(events, results):
+            if not ok:
+                logger.error(f"Failed to deliver event {event_name} in batch")
+            if self.on_result:
+                self.on_result(event_name, prepared_data, ok)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed and (self._deadline is None or time.monotonic() < self._deadline):
+                    timeout = None if self._deadline is None else self._deadline - time.monotonic()
+                    self._wakeup.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take()
+            if batch[0]:
+                self._send(*batch)
+
+    def stats(self):
+        """Return batching counters for monitoring."""
+        with self._lock:
+            return {
+                'pending': len(self._events),
+                'pending_bytes': self._size,
+                'batches_sent': self.batches_sent,
+                'events_sent': self.events_sent,
+                'events_failed': self.events_failed
+            }
+
+    def close(self):
+        """Stop the flusher thread and send any pending events."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify_all()
+        self._flusher.join(1.0)
+        self.flush()
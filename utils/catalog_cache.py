@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class CatalogCache:
+    def __init__(self, ttl=300, max_entries=1024, version_file=None, check_interval=1.0):
+        """
+        In-process read-through cache for catalog data with TTL and explicit
+        invalidation.
+
+        Values live in each worker process. When version_file is set, it acts
+        as a shared invalidation channel: invalidate() touches it, and every
+        worker drops its entries once it notices the file's mtime changed.
+        The file is checked at most once every check_interval seconds.
+
+        Args:
+            ttl (float): Seconds an entry stays fresh
+            max_entries (int): Maximum entries kept; least recently used are evicted
+            version_file (str, optional): Path of the file shared by all workers
+            check_interval (float): Minimum seconds between version file checks
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_file = version_file
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local_version = 0
+        self._shared_version = self._read_shared_version()
+        self._next_check = time.monotonic() + check_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _read_shared_version(self):
+        if not self.version_file:
+            return 0
+        try:
+            return os.stat(self.version_file).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _sync_shared_version(self, now):
+        """Drop local entries if another worker invalidated the catalog. Caller holds the lock."""
+        if not self.version_file or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        shared = self._read_shared_version()
+        if shared != self._shared_version:
+            self._shared_version = shared
+            self._local_version += 1
+            self._entries.clear()
+
+    @property
+    def version(self):
+        """Changes whenever the catalog is invalidated, in this or any other worker."""
+        with self._lock:
+            self._sync_shared_version(time.monotonic())
+            return f"{self._shared_version}.{self._local_version}"
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, calling loader() on a miss.
+
+        Args:
+            key: Hashable cache key
+            loader (callable): Produces the value from the database
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sync_shared_version(now)
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            version = self._local_version
+
+        value = loader()
+
+        with self._lock:
+            # Skip storing if the catalog was invalidated while loading
+            if version == self._local_version:
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self):
+        """Drop every cached entry here and signal other workers to do the same."""
+        with self._lock:
+            self._entries.clear()
+            self._local_version += 1
+            self.invalidations += 1
+            if self.version_file:
+                with open(self.version_file, 'a'):
+                    pass
+                os.utime(self.version_file, ns=(time.time_ns(), time.time_ns()))
+                self._shared_version = self._read_shared_version()
+
+    def stats(self):
+        """Return cache counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
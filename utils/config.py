@@ -1,3 +1,5 @@
+import os
+
 # Google Tag Manager Server-Side Configuration
 GTM_CONFIG = {
     # GTM server container URL (using your domain)
@@ -10,5 +12,233 @@ GTM_CONFIG = {
     'api_secret': None,
     
     # Container configuration for manual provisioning
-    'container_config': 'aWQ9R1RNLVRKWFdSQzlKJmVudj0xJmF1dGg9dzVsWkJudFlZZVllYjlfeHZiU3hKdw=='
-}
\ No newline at end of file
+    'container_config': 'aWQ9R1RNLVRKWFdSQzlKJmVudj0xJmF1dGg9dzVsWkJudFlZZVllYjlfeHZiU3hKdw==',
+    
+    # Number of recent events kept in memory for the /gtm/debug interface
+    'history_size': 1000,
+    
+    # Server-Sent Events stream at /gtm/stream. A subscriber that falls
+    # max_buffer events behind is disconnected instead of slowing tracking.
+    'stream': {
+        'max_buffer': 100,
+        'keepalive_seconds': 15
+    },
+    
+    # Background dispatch so request handlers never wait on the GTM server.
+    # overflow_policy is one of 'drop_oldest', 'drop_newest' or 'block'
+    # (wait up to block_timeout seconds for room in the queue).
+    'dispatch': {
+        'enabled': True,
+        'max_queue_size': 1000,
+        'workers': 2,
+        'overflow_policy': 'drop_oldest',
+        'block_timeout': 0.05
+    },
+    
+    # Batched delivery: one POST per flush instead of one per event. A batch
+    # is flushed at max_events events, max_bytes of JSON or after max_wait_ms,
+    # whichever comes first. Requires a tagging server that accepts
+    # {"events": [...]} payloads on /collect.
+    'batch': {
+        'enabled': False,
+        'max_events': 25,
+        'max_bytes': 65536,
+        'max_wait_ms': 250
+    },
+    
+    # Encoding of bodies sent to the tagging server. json is 'auto' (orjson
+    # when installed), 'orjson' or 'json'. compression is None, 'gzip' or
+    # 'zstd' (needs the zstandard package) and only applies to bodies of at
+    # least min_bytes; the tagging server must accept that Content-Encoding.
+    'encoding': {
+        'json': 'auto',
+        'compression': None,
+        'compression_level': None,
+        'min_bytes': 1024
+    },
+    
+    # Keep-alive connection pool for the tagging server. Timeouts are in
+    # seconds; only connection failures are retried, with exponential backoff.
+    'http': {
+        'pool_size': 10,
+        'keep_alive': True,
+        'connect_timeout': 2.0,
+        'read_timeout': 5.0,
+        'retries': 2,
+        'backoff_factor': 0.2,
+        'pool_block': False
+    },
+    
+    # Page views reported by the track_pageview decorator. They are sent
+    # after the response, and only for these methods; responses with a
+    # status in skip_statuses (redirects, errors) are not reported.
+    'pageview': {
+        'methods': ['GET'],
+        'skip_statuses': [301, 302, 303, 307, 308, 400, 401, 403, 404, 405, 429, 500, 502, 503]
+    },
+    
+    # Which events are sent upstream. rates keeps that fraction of clients
+    # per event name (hashed on client_id, so a client is kept or dropped
+    # as a whole). event_limits are token buckets shared by all clients,
+    # client_limits apply to each client; '*' covers names without their
+    # own entry. always_send events skip every check.
+    'sampling': {
+        'enabled': True,
+        'rates': {
+            'page_view': 1.0
+        },
+        'default_rate': 1.0,
+        'event_limits': {
+            '*': {'rate': 200, 'burst': 400}
+        },
+        'client_limits': {
+            '*': {'rate': 2, 'burst': 20}
+        },
+        'always_send': ['purchase'],
+        'max_clients': 10000,
+        'salt': ''
+    },
+    
+    # Repeated events (a refresh, a double-submitted form) within
+    # window_seconds are sent once. Purchases are matched on transaction_id
+    # for purchase_window_seconds. max_entries bound the memory used.
+    'dedup': {
+        'enabled': True,
+        'window_seconds': 5.0,
+        'max_entries': 10000,
+        'purchase_window_seconds': 86400.0,
+        'purchase_max_entries': 100000
+    },
+    
+    # On-disk spool for events that fail delivery or overflow the dispatch
+    # queue. Spooled events are replayed at replay_rate events per second
+    # once the tagging server accepts them again. Inspect, compact or replay
+    # by hand with: python -m utils.spool {inspect,compact,replay}
+    'spool': {
+        'enabled': True,
+        'directory': 'spool',
+        'segment_bytes': 4 * 1024 * 1024,
+        'fsync': False,
+        'replay_rate': 50,
+        'replay_interval': 5.0
+    }
+}
+
+# Ingestion pipeline behind the /collect endpoint. sink is one of 'memory',
+# 'sqlite' or 'spool'. rate_limit and burst are events per client IP.
+# max_body_bytes caps JSON bodies, which are parsed whole; NDJSON bodies are
+# streamed and only each line is capped by max_event_bytes.
+INGEST_CONFIG = {
+    'sink': 'sqlite',
+    'sqlite_path': 'instance/collected_events.db',
+    'sqlite_pool_size': 4,
+    'spool_directory': 'spool/collect',
+    'memory_capacity': 10000,
+    'rate_limit': 1000,
+    'burst': 2000,
+    'max_event_bytes': 8192,
+    'max_body_bytes': 1024 * 1024
+}
+
+# Database engine. DATABASE_URL selects the backend (sqlite:///shop.db,
+# postgresql://..., mysql://...). The sqlite settings apply only to SQLite
+# and the pool settings only to server databases.
+DATABASE_CONFIG = {
+    'uri': os.environ.get('DATABASE_URL', 'sqlite:///shop.db'),
+    
+    # WAL lets readers proceed while a writer commits; busy_timeout makes
+    # writers wait for the lock instead of failing with "database is locked"
+    'sqlite': {
+        'journal_mode': 'WAL',
+        'busy_timeout_ms': 5000,
+        'synchronous': 'NORMAL'
+    },
+    
+    'pool': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    },
+    
+    # Opt-in SQL profiler (SQL_PROFILER=1): per-request query counts, DB time
+    # and duplicate statements on the debug page and in a Server-Timing
+    # header, and statements slower than slow_query_ms logged with their
+    # query plan. Not meant for production traffic.
+    'profiler': {
+        'enabled': os.environ.get('SQL_PROFILER', '0') == '1',
+        'slow_query_ms': 50,
+        'explain': True,
+        'log_file': 'slow_queries.log',
+        'recent_requests': 200,
+        'recent_slow_queries': 50,
+        'duplicate_warning': 5
+    }
+}
+
+# Read-through catalog cache used by the storefront pages. Entries expire
+# after catalog_ttl seconds and are dropped whenever products change.
+# shared_version_file (relative to the Flask instance folder) propagates
+# invalidations to every worker process; set it to None for a single process.
+CACHE_CONFIG = {
+    'catalog_ttl': 300,
+    'catalog_max_entries': 1024,
+    'shared_version_file': 'catalog.version',
+    'version_check_interval': 1.0,
+    
+    # Rendered anonymous pages and product grid fragments, keyed by route,
+    # arguments and catalog version
+    'page_max_entries': 512,
+    'fragment_max_entries': 64
+}
+
+# Static assets. `flask build-assets` copies static files to static/<output>
+# under content-hashed names with .gz/.br siblings; url_for('static', ...)
+# then points at those copies, served with max_age and immutable caching.
+ASSET_CONFIG = {
+    'output': 'dist',
+    'exclude': ['media'],
+    'max_age': 31536000
+}
+
+# Product image uploads. Originals and resized variants (each at most
+# width x height pixels, plus WebP copies) are written to directory,
+# relative to the app root, under content-hashed names and served from
+# /media with far-future immutable caching. Variants need Pillow.
+IMAGE_CONFIG = {
+    'directory': 'static/media',
+    'variants': {
+        'thumb': 100,
+        'card': 400,
+        'full': 1200
+    },
+    'webp': True,
+    'jpeg_quality': 82,
+    'webp_quality': 80,
+    'workers': 2,
+    'max_age': 31536000
+}
+
+# Password hashing and login throttling. Hashes run in a pool of worker
+# processes; once max_pending are queued or running, logins and registrations
+# get a 503 instead of waiting. Changing method upgrades each user's stored
+# hash on their next successful login. Login attempts are limited per client
+# IP and per username (rate = attempts regained per second, burst = attempts
+# allowed at once) before any hashing happens. Every attempt counts against
+# the IP (refunded when it succeeds); only failed ones count against
+# (IP, username), and a successful login clears those.
+AUTH_CONFIG = {
+    'hashing': {
+        'method': 'scrypt:32768:8:1',
+        'workers': 2,
+        'max_pending': 8,
+        'timeout': 10.0
+    },
+    'login_limits': {
+        'ip_rate': 0.2,
+        'ip_burst': 10,
+        'username_rate': 0.05,
+        'username_burst': 5
+    }
+}
@@ -0,0 +1,104 @@
+import logging
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger('gtm_server')
+
+SQLITE_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SQLITE_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS for the configured backend.
+
+    Args:
+        config (dict): DATABASE_CONFIG
+
+    Returns:
+        dict: Keyword arguments for create_engine
+    """
+    if is_sqlite(config['uri']):
+        busy_timeout = config.get('sqlite', {}).get('busy_timeout_ms', 5000)
+        return {'connect_args': {'timeout': busy_timeout / 1000.0}}
+    return dict(config.get('pool', {}))
+
+
+def configure_engine(engine, config):
+    """
+    Apply per-connection SQLite pragmas (journal mode, busy timeout,
+    synchronous level) to every new connection made by the engine.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    sqlite_config = config.get('sqlite', {})
+    journal_mode = sqlite_config.get('journal_mode', 'WAL').upper()
+    synchronous = sqlite_config.get('synchronous', 'NORMAL').upper()
+    busy_timeout = int(sqlite_config.get('busy_timeout_ms', 5000))
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Unknown SQLite journal mode: {journal_mode}")
+    if synchronous not in SQLITE_SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Unknown SQLite synchronous level: {synchronous}")
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+
+def upsert_increment(session, model, keys, column, amount):
+    """
+    Insert a row, or add amount to column if a row with the same unique keys
+    exists, in a single statement.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE on SQLite and PostgreSQL and
+    INSERT ... ON DUPLICATE KEY UPDATE on MySQL, so concurrent calls never
+    create duplicates or lose an increment. Other backends fall back to an
+    insert that turns into an update when the unique constraint rejects it.
+
+    Args:
+        session: SQLAlchemy session (the caller commits)
+        model: Mapped class with a unique constraint over keys
+        keys (dict): Values of the unique key columns
+        column (str): Column to increment
+        amount: Value inserted, or added to the existing value
+    """
+    table = model.__table__
+    values = dict(keys, **{column: amount})
+    dialect = session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + stmt.excluded[column]}
+        )
+        session.execute(stmt)
+        return
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql.insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update({column: table.c[column] + stmt.inserted[column]})
+        session.execute(stmt)
+        return
+
+    try:
+        with session.begin_nested():
+            session.execute(table.insert().values(**values))
+    except IntegrityError:
+        condition = [table.c[k] == v for k, v in keys.items()]
+        session.execute(table.update().where(*condition).values({column: table.c[column] + amount}))
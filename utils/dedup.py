@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def freeze(value):
+    """Hashable, order-independent form of JSON-like event data."""
+    if isinstance(value, dict):
+        return frozenset((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(freeze(item) for item in value)
+    return value
+
+
+class DedupWindow:
+    def __init__(self, window_seconds=5.0, max_entries=10000):
+        """
+        Remember recently seen fingerprints to suppress repeated events.
+
+        Fingerprints are kept in insertion order with the time they expire,
+        so expired entries are always at the front and are dropped as new
+        ones arrive. Memory is bounded by max_entries: beyond it the oldest
+        fingerprint is evicted even if its window has not passed yet.
+
+        Args:
+            window_seconds (float): How long a fingerprint suppresses repeats
+            max_entries (int): Maximum fingerprints kept
+        """
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.checks = 0
+        self.duplicates = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def seen(self, fingerprint):
+        """
+        Record a fingerprint.
+
+        Returns:
+            bool: True if the fingerprint was already seen within the window
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.checks += 1
+            while self._seen:
+                oldest, expires_at = next(iter(self._seen.items()))
+                if expires_at > now:
+                    break
+                del self._seen[oldest]
+                self.expirations += 1
+
+            if fingerprint in self._seen:
+                self.duplicates += 1
+                return True
+
+            self._seen[fingerprint] = now + self.window_seconds
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+                self.evictions += 1
+            return False
+
+    def stats(self):
+        """Return dedup counters for monitoring."""
+        with self._lock:
+            return {
+                'entries': len(self._seen),
+                'checks': self.checks,
+                'duplicates': self.duplicates,
+                'hit_ratio': round(self.duplicates / self.checks, 4) if self.checks else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions
+            }
+
+
+class EventDeduplicator:
+    def __init__(self, window_seconds=5.0, max_entries=10000, purchase_window_seconds=86400.0,
+                 purchase_max_entries=100000):
+        """
+        Suppress events identical to one sent moments earlier.
+
+        An event's fingerprint is its name, client, page and data, so a page
+        refresh or a double-submitted form within window_seconds is sent once.
+        Purchases are matched on transaction_id alone, over a much longer
+        window, so a retried checkout never reports the same order twice.
+
+        Args:
+            window_seconds (float): Window for ordinary events
+            max_entries (int): Fingerprints kept for ordinary events
+            purchase_window_seconds (float): Window for purchase transaction IDs
+            purchase_max_entries (int): Transaction IDs kept
+        """
+        self.events = DedupWindow(window_seconds, max_entries)
+        self.purchases = DedupWindow(purchase_window_seconds, purchase_max_entries)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a deduplicator from GTM_CONFIG['dedup'], or return None when it is disabled."""
+        if not config or not config.get('enabled'):
+            return None
+        return cls(
+            window_seconds=config.get('window_seconds', 5.0),
+            max_entries=config.get('max_entries', 10000),
+            purchase_window_seconds=config.get('purchase_window_seconds', 86400.0),
+            purchase_max_entries=config.get('purchase_max_entries', 100000)
+        )
+
+    def is_duplicate(self, event_name, event_data, client_id, page):
+        """
+        Check an event before it is prepared and remember it.
+
+        Args:
+            event_name (str): Name of the event
+            event_data (dict): Event data as passed to send_event
+            client_id (str): Client the event belongs to
+            page (str): Path and query string of the page the event was sent from
+
+        Returns:
+            bool: True if the event should be suppressed
+        """
+        event_data = event_data or {}
+        if event_name == 'purchase' and event_data.get('transaction_id') is not None:
+            return self.purchases.seen(str(event_data['transaction_id']))
+        try:
+            fingerprint = hash((event_name, client_id, page, freeze(event_data)))
+        except TypeError:
+            # Unhashable data (e.g. custom objects) is never treated as a duplicate
+            return False
+        return self.events.seen(fingerprint)
+
+    def stats(self):
+        return {
+            'events': self.events.stats(),
+            'purchases': self.purchases.stats()
+        }
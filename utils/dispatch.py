@@ -0,0 +1,168 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('gtm_server')
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class EventDispatcher:
+    def __init__(self, handler, max_queue_size=1000, num_workers=2,
+                 overflow_policy=DROP_OLDEST, block_timeout=0.05, on_drop=None):
+        """
+        Bounded in-process queue drained by a pool of worker threads.
+
+        Args:
+            handler (callable): Called as handler(*job) by a worker for every queued job
+            max_queue_size (int): Maximum number of jobs waiting to be handled
+            num_workers (int): Number of worker threads
+            overflow_policy (str): 'drop_oldest', 'drop_newest' or 'block'
+            block_timeout (float): Seconds to wait for room when the policy is 'block'
+            on_drop (callable, optional): Called as on_drop(*job) for every discarded job
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.handler = handler
+        self.max_queue_size = max_queue_size
+        self.num_workers = num_workers
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.on_drop = on_drop
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._closed = False
+
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run, name=f"gtm-dispatch-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        atexit.register(self.shutdown)
+
+    def submit(self, *job):
+        """
+        Queue a job without waiting for it to be handled.
+
+        Returns:
+            bool: True if the job was queued, False if it was dropped
+        """
+        dropped_job = None
+        with self._lock:
+            if self._closed:
+                dropped_job = job
+            elif len(self._queue) >= self.max_queue_size:
+                if self.overflow_policy == DROP_OLDEST:
+                    dropped_job = self._queue.popleft()
+                elif self.overflow_policy == BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.max_queue_size and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._not_full.wait(remaining)
+                    if len(self._queue) >= self.max_queue_size or self._closed:
+                        dropped_job = job
+                else:
+                    dropped_job = job
+
+            if dropped_job is not job:
+                self._queue.append(job)
+                self.enqueued += 1
+                self._not_empty.notify()
+            if dropped_job is not None:
+                self.dropped += 1
+
+        if dropped_job is not None:
+            self._drop(dropped_job)
+        return dropped_job is not job
+
+    def _drop(self, job):
+        logger.warning(f"Dispatch queue full, dropping job ({self.overflow_policy})")
+        if self.on_drop:
+            try:
+                self.on_drop(*job)
+            except Exception as e:
+                logger.error(f"Error in dispatch drop handler: {str(e)}")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return
+                job = self._queue.popleft()
+                self._in_flight += 1
+                self._not_full.notify()
+
+            try:
+                self.handler(*job)
+            except Exception as e:
+                logger.error(f"Unhandled exception in dispatch worker: {str(e)}")
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self.processed += 1
+                    self._not_full.notify_all()
+
+    def depth(self):
+        """Return the number of jobs waiting in the queue."""
+        return len(self._queue)
+
+    def stats(self):
+        """Return queue counters for monitoring."""
+        with self._lock:
+            return {
+                'depth': len(self._queue),
+                'in_flight': self._in_flight,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'max_queue_size': self.max_queue_size,
+                'workers': self.num_workers,
+                'overflow_policy': self.overflow_policy
+            }
+
+    def shutdown(self, timeout=5.0):
+        """
+        Stop accepting jobs and drain the queue.
+
+        Args:
+            timeout (float): Maximum seconds to wait for queued jobs to be handled
+
+        Returns:
+            bool: True if the queue was fully drained, False otherwise
+        """
+        with self._lock:
+            if self._closed:
+                return not self._queue
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+        remaining = len(self._queue)
+        if remaining:
+            logger.warning(f"Dispatch queue shut down with {remaining} undelivered jobs")
+        else:
+            logger.info("Dispatch queue drained")
+        return remaining == 0
@@ -0,0 +1,106 @@
+import gzip
+import json
+import logging
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('gtm_server')
+
+JSON_ENCODERS = ('auto', 'orjson', 'json')
+COMPRESSION_METHODS = (None, 'gzip', 'zstd')
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=str)
+
+
+class PayloadEncoder:
+    def __init__(self, json_encoder='auto', compression=None, compression_level=None, min_bytes=1024):
+        """
+        Encode outgoing event payloads as compact JSON and optionally compress them.
+
+        orjson and zstandard are optional: 'auto' uses orjson when it is
+        installed, and zstd compression falls back to uncompressed bodies
+        (with a warning) when zstandard is missing.
+
+        Args:
+            json_encoder (str): 'auto', 'orjson' or 'json'
+            compression (str, optional): None, 'gzip' or 'zstd'. The tagging server
+                must accept the matching Content-Encoding
+            compression_level (int, optional): Codec level, defaults to 6 for gzip and 3 for zstd
+            min_bytes (int): Bodies smaller than this are sent uncompressed
+        """
+        if json_encoder not in JSON_ENCODERS:
+            raise ValueError(f"Unknown JSON encoder: {json_encoder}")
+        if compression not in COMPRESSION_METHODS:
+            raise ValueError(f"Unknown compression method: {compression}")
+
+        if json_encoder == 'orjson' and orjson is None:
+            logger.warning("orjson is not installed, encoding events with the json module")
+        use_orjson = orjson is not None and json_encoder != 'json'
+        self.json_encoder = 'orjson' if use_orjson else 'json'
+        self.dumps = _orjson_dumps if use_orjson else _json_dumps
+
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, sending event bodies uncompressed")
+            compression = None
+        self.compression = compression
+        self.min_bytes = min_bytes
+        if compression == 'gzip':
+            self.compression_level = compression_level if compression_level is not None else 6
+        elif compression == 'zstd':
+            self.compression_level = compression_level if compression_level is not None else 3
+        else:
+            self.compression_level = None
+        # ZstdCompressor objects must not be shared between threads
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build an encoder from GTM_CONFIG['encoding']."""
+        config = config or {}
+        return cls(
+            json_encoder=config.get('json', 'auto'),
+            compression=config.get('compression'),
+            compression_level=config.get('compression_level'),
+            min_bytes=config.get('min_bytes', 1024)
+        )
+
+    def compress(self, body):
+        """
+        Compress an encoded body if compression is on and the body is large enough.
+
+        Returns:
+            tuple: (body, Content-Encoding value or None)
+        """
+        if self.compression is None or len(body) < self.min_bytes:
+            return body, None
+        if self.compression == 'gzip':
+            # mtime=0 keeps the output deterministic for identical bodies
+            return gzip.compress(body, compresslevel=self.compression_level, mtime=0), 'gzip'
+        compressor = getattr(self._local, 'zstd', None)
+        if compressor is None:
+            compressor = self._local.zstd = zstandard.ZstdCompressor(level=self.compression_level)
+        return compressor.compress(body), 'zstd'
+
+    def encode(self, obj):
+        """
+        Encode one payload.
+
+        Returns:
+            tuple: (body bytes, Content-Encoding value or None)
+        """
+        return self.compress(self.dumps(obj))
@@ -0,0 +1,150 @@
+import json
+import threading
+from collections import deque
+
+
+def encode_record(record):
+    """
+    JSON for one event record, computed once and memoised on the record.
+
+    '<' is escaped so the result can be embedded in a <script> block.
+    """
+    encoded = record.get('_json')
+    if encoded is None:
+        encoded = json.dumps({
+            'seq': record['seq'],
+            'timestamp': record['timestamp'],
+            'event_name': record['event_name'],
+            'data': record['data']
+        }, separators=(',', ':'), default=str).replace('<', '\\u003c')
+        record['_json'] = encoded
+    return encoded
+
+
+class EventRing:
+    def __init__(self, capacity=1000):
+        """
+        Fixed-capacity ring buffer of event records with per-event-name indexes.
+
+        Writers hold a short lock while they take a sequence number and
+        publish the record, so head only ever advances past slots that have
+        been written and a reader's cursor never skips an event. Readers take
+        no lock: they validate every slot against the sequence number they
+        expect, so a record that has been overwritten by a concurrent writer
+        is skipped, never returned under the wrong name.
+
+        Args:
+            capacity (int): Number of records kept
+        """
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._head = 0
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """
+        Store a record (a dict with an 'event_name' key) in O(1).
+
+        Returns:
+            int: The sequence number assigned to the record
+        """
+        with self._lock:
+            seq = self._head
+            record['seq'] = seq
+            self._slots[seq % self.capacity] = record
+
+            index = self._by_name.get(record['event_name'])
+            if index is None:
+                index = self._by_name[record['event_name']] = deque(maxlen=self.capacity)
+            index.append(seq)
+
+            # Published last, once the slot holds the record
+            self._head = seq + 1
+        return seq
+
+    def _get(self, seq):
+        record = self._slots[seq % self.capacity]
+        if record is not None and record['seq'] == seq:
+            return record
+        return None
+
+    def latest(self, limit=10, event_name=None):
+        """
+        Return up to `limit` records, newest first, in O(limit).
+
+        Args:
+            limit (int): Maximum number of records to return
+            event_name (str, optional): Only return records with this event name
+        """
+        results = []
+        if event_name is None:
+            seq = self._head - 1
+            stop = max(self._head - self.capacity, 0)
+            while seq >= stop and len(results) < limit:
+                record = self._get(seq)
+                if record is not None:
+                    results.append(record)
+                seq -= 1
+            return results
+
+        index = self._by_name.get(event_name)
+        if index is None:
+            return results
+
+        # Index by position rather than iterating: iterating a deque that a
+        # writer appends to concurrently raises RuntimeError.
+        previous = None
+        i = 1
+        while len(results) < limit:
+            try:
+                seq = index[-i]
+            except IndexError:
+                break
+            i += 1
+            if previous is not None and seq >= previous:
+                continue
+            record = self._get(seq)
+            if record is None:
+                break
+            results.append(record)
+            previous = seq
+        return results
+
+    def since(self, cursor, limit=100):
+        """
+        Return the oldest records with a sequence number above cursor.
+
+        Only the new records are visited, so polling with the last seen
+        sequence number costs O(new events). When more than limit records
+        are waiting, the next call with the last returned sequence number
+        continues where this one stopped.
+
+        Args:
+            cursor (int): Last sequence number the caller has seen (-1 for none)
+            limit (int): Maximum number of records to return
+
+        Returns:
+            tuple: (records oldest first, number of records after cursor that
+                were overwritten before they could be read)
+        """
+        head = self._head
+        start = max(cursor + 1, head - self.capacity, 0)
+        missed = start - (cursor + 1) if cursor >= 0 else 0
+        results = []
+        for seq in range(start, min(start + limit, head)):
+            record = self._get(seq)
+            if record is not None:
+                results.append(record)
+            else:
+                # Overwritten by a writer that lapped this reader
+                missed += 1
+        return results, missed
+
+    @property
+    def head(self):
+        """Sequence number the next record will get."""
+        return self._head
+
+    def __len__(self):
+        return min(self._head, self.capacity)
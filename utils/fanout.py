@@ -0,0 +1,119 @@
+import threading
+import time
+
+
+class Subscription:
+    def __init__(self, broadcaster, event_names=None, max_buffer=100):
+        """
+        One consumer of the event stream, reading the event history from its
+        own cursor.
+
+        Args:
+            broadcaster (EventBroadcaster): Source of events
+            event_names (iterable, optional): Only receive these event names
+            max_buffer (int): Events the subscriber may fall behind before it
+                is evicted (at most the history's capacity)
+        """
+        self.broadcaster = broadcaster
+        self.event_names = frozenset(event_names) if event_names else None
+        self.max_buffer = min(max_buffer, broadcaster.history.capacity)
+        self.cursor = broadcaster.history.head - 1
+        self.evicted = False
+        self.closed = False
+
+    def _evict(self):
+        self.evicted = True
+        self.broadcaster.unsubscribe(self)
+
+    def get(self, timeout=15.0, linger=0.05):
+        """
+        Wait for new events.
+
+        The subscriber checks the history every linger seconds instead of
+        being woken by the publisher, so events arriving close together are
+        delivered in one batch and publishing costs the request thread
+        nothing per subscriber. A subscriber found more than max_buffer
+        events behind is evicted.
+
+        Args:
+            timeout (float): Seconds to wait for the first event
+            linger (float): Seconds between checks of the history
+
+        Returns:
+            list: New records, oldest first (empty on timeout), or None once
+                the subscriber has been evicted or closed
+        """
+        history = self.broadcaster.history
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.evicted or self.closed:
+                return None
+            behind = history.head - 1 - self.cursor
+            if behind > self.max_buffer:
+                self._evict()
+                return None
+            if behind > 0:
+                records, missed = history.since(self.cursor, self.max_buffer)
+                if missed:
+                    self._evict()
+                    return None
+                if records:
+                    self.cursor = records[-1]['seq']
+                if self.event_names is not None:
+                    records = [r for r in records if r['event_name'] in self.event_names]
+                if records:
+                    return records
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            time.sleep(min(max(linger, 0.001), remaining))
+
+    def close(self):
+        self.closed = True
+        self.broadcaster.unsubscribe(self)
+
+
+class EventBroadcaster:
+    def __init__(self, history):
+        """
+        Stream the records of an event history to subscribers.
+
+        Subscribers read the history (an EventRing) from their own cursors,
+        so publish() does no per-subscriber work and a slow consumer never
+        back-pressures the publisher: it is evicted the next time it reads
+        and finds it has fallen too far behind.
+
+        Args:
+            history (EventRing): Where published records are stored
+        """
+        self.history = history
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, event_names=None, max_buffer=100):
+        subscription = Subscription(self, event_names, max_buffer)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+                if subscription.evicted:
+                    self.evictions += 1
+
+    def publish(self, record):
+        """Count a record already appended to the history. Subscribers pick it up on their next check."""
+        if self._subscribers:
+            self.published += 1
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'evictions': self.evictions
+        }
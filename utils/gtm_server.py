@@ -1,18 +1,50 @@
-import requests
-import json
 import uuid
+import time
 import logging
 import base64
 from datetime import datetime
 from functools import wraps
-from flask import request, session, g
+from flask import request, session, g, make_response
+from utils.dispatch import EventDispatcher
+from utils.batching import EventBatcher
+from utils.http_pool import PooledSession
+from utils.spool import EventSpool, SpoolReplayer
+from utils.event_history import EventRing
+from utils.fanout import EventBroadcaster
+from utils.sampling import EventSampler
+from utils.dedup import EventDeduplicator
+from utils.encoding import PayloadEncoder
+from utils.metrics import Counter, Gauge, Histogram
 
 # Configure logging
 logging.basicConfig(filename='gtm_server.log', level=logging.INFO)
 logger = logging.getLogger('gtm_server')
 
+# Metrics exposed at /metrics
+PREPARE_DURATION = Histogram(
+    'gtm_prepare_event_duration_seconds', "Time spent in _prepare_event", ('event_name',))
+SEND_DURATION = Histogram(
+    'gtm_send_event_duration_seconds', "Time send_event adds to the calling request", ('event_name',))
+PAGEVIEW_DURATION = Histogram(
+    'gtm_pageview_tracking_duration_seconds', "Time the track_pageview decorator adds before the response is sent")
+EVENTS = Counter(
+    'gtm_events_total', "Events passed to send_event by outcome", ('event_name', 'outcome'))
+UPSTREAM_RESPONSES = Counter(
+    'gtm_upstream_responses_total', "Responses from the GTM server by status code", ('kind', 'status'))
+DISPATCH_QUEUE_DEPTH = Gauge(
+    'gtm_dispatch_queue_depth', "Events waiting in the dispatch queue")
+DISPATCH_DROPPED = Gauge(
+    'gtm_dispatch_dropped_events', "Events dropped by the dispatch queue since start")
+SPOOL_BYTES = Gauge(
+    'gtm_spool_bytes', "Bytes of undelivered events spooled on disk")
+STREAM_SUBSCRIBERS = Gauge(
+    'gtm_stream_subscribers', "Connected /gtm/stream subscribers")
+
 class GTMServerSide:
-    def __init__(self, gtm_server_url, container_id, api_secret=None, container_config=None):
+    def __init__(self, gtm_server_url, container_id, api_secret=None, container_config=None,
+                 dispatch_config=None, batch_config=None, http_config=None,
+                 spool_config=None, sampling_config=None, dedup_config=None,
+                 encoding_config=None, pageview_config=None, history_size=1000):
         """
         Initialize the GTM server-side tracking module.
         
@@ -21,6 +53,34 @@ class GTMServerSide:
             container_id (str): Your GTM container ID (GTM-XXXXXX)
             api_secret (str, optional): API secret for authenticated requests
             container_config (str, optional): Container configuration for manual provisioning
+            dispatch_config (dict, optional): Background dispatch settings. When enabled,
+                send_event queues the prepared event and returns without waiting for the
+                GTM server. Keys: enabled, max_queue_size, workers, overflow_policy,
+                block_timeout
+            batch_config (dict, optional): Batched delivery settings. When enabled,
+                events are posted to /collect as one {"events": [...]} payload per flush.
+                Keys: enabled, max_events, max_bytes, max_wait_ms
+            http_config (dict, optional): Connection pool settings for the GTM server.
+                Keys: pool_size, keep_alive, connect_timeout, read_timeout, retries,
+                backoff_factor, pool_block
+            spool_config (dict, optional): On-disk spool for events that fail delivery
+                or overflow the dispatch queue, replayed in the background.
+                Keys: enabled, directory, segment_bytes, fsync, replay_rate,
+                replay_interval
+            sampling_config (dict, optional): Deterministic per-client sampling and
+                token bucket limits per event type and per client, applied before
+                an event is prepared. Keys: enabled, rates, default_rate,
+                event_limits, client_limits, always_send, max_clients, salt
+            dedup_config (dict, optional): Suppression of events repeated within a
+                window, with purchases matched on transaction_id. Keys: enabled,
+                window_seconds, max_entries, purchase_window_seconds,
+                purchase_max_entries
+            encoding_config (dict, optional): JSON encoder and compression of outgoing
+                bodies. Keys: json ('auto', 'orjson' or 'json'), compression (None,
+                'gzip' or 'zstd'), compression_level, min_bytes
+            pageview_config (dict, optional): Which responses the track_pageview
+                decorator reports. Keys: methods, skip_statuses
+            history_size (int): Number of recent events kept for the debug interface
         """
         self.gtm_server_url = gtm_server_url
         self.container_id = container_id
@@ -28,9 +88,80 @@ class GTMServerSide:
         self.container_config = container_config
         self.is_provisioned = False
         
-        # Event history for debug interface - store last 50 events
-        self.event_history = []
-        self.max_history_size = 50
+        # Responses the track_pageview decorator reports
+        pageview_config = pageview_config or {}
+        self.pageview_methods = frozenset(pageview_config.get('methods', ('GET',)))
+        self.pageview_skip_statuses = frozenset(pageview_config.get('skip_statuses', ()))
+        
+        # Duplicate suppression - None means repeated events are all sent
+        self.deduplicator = EventDeduplicator.from_config(dedup_config)
+        
+        # Sampling and rate limits - None means every event is sent
+        self.sampler = EventSampler.from_config(sampling_config)
+        
+        # Serialisation and compression of outgoing bodies
+        self.encoder = PayloadEncoder.from_config(encoding_config)
+        
+        # Keep-alive connection pool shared by all delivery paths
+        self.http = PooledSession(**(http_config or {}))
+        
+        # Spool for undeliverable events - None means they are dropped
+        self.spool = None
+        self.replayer = None
+        spool_config = spool_config or {}
+        if spool_config.get('enabled'):
+            self.spool = EventSpool(
+                spool_config.get('directory', 'spool'),
+                segment_bytes=spool_config.get('segment_bytes', 4 * 1024 * 1024),
+                fsync=spool_config.get('fsync', False)
+            )
+            self.replayer = SpoolReplayer(
+                self.spool,
+                self._deliver,
+                rate=spool_config.get('replay_rate', 50),
+                interval=spool_config.get('replay_interval', 5.0)
+            )
+        
+        # Batched delivery - None means one POST per event
+        self.batcher = None
+        batch_config = batch_config or {}
+        if batch_config.get('enabled'):
+            self.batcher = EventBatcher(
+                self._deliver_batch,
+                max_events=batch_config.get('max_events', 25),
+                max_bytes=batch_config.get('max_bytes', 64 * 1024),
+                max_wait_ms=batch_config.get('max_wait_ms', 250),
+                on_result=self._on_batch_result,
+                encode=self.encoder.dumps
+            )
+        
+        # Background dispatch queue - None means events are sent inline
+        self.dispatcher = None
+        dispatch_config = dispatch_config or {}
+        if dispatch_config.get('enabled'):
+            self.dispatcher = EventDispatcher(
+                self._transmit,
+                max_queue_size=dispatch_config.get('max_queue_size', 1000),
+                num_workers=dispatch_config.get('workers', 2),
+                overflow_policy=dispatch_config.get('overflow_policy', 'drop_oldest'),
+                block_timeout=dispatch_config.get('block_timeout', 0.05),
+                on_drop=self._spool_event
+            )
+        
+        # Event history for debug interface - fixed-capacity ring buffer
+        self.max_history_size = history_size
+        self.event_history = EventRing(history_size)
+        
+        # Live subscribers of the /gtm/stream endpoint
+        self.broadcaster = EventBroadcaster(self.event_history)
+        
+        # Gauges are computed when /metrics is scraped
+        if self.dispatcher:
+            DISPATCH_QUEUE_DEPTH.set_function(self.dispatcher.depth)
+            DISPATCH_DROPPED.set_function(lambda: self.dispatcher.dropped)
+        if self.spool:
+            SPOOL_BYTES.set_function(lambda: self.spool.stats()['bytes_on_disk'])
+        STREAM_SUBSCRIBERS.set_function(lambda: self.broadcaster.stats()['subscribers'])
         
         # If container config is provided, we can attempt manual provisioning
         if self.container_config:
@@ -66,19 +197,28 @@ class GTMServerSide:
     
     def _get_client_id(self):
         """Get or generate a persistent client ID."""
+        return self._request_context()['client_id']
+    
+    def _request_context(self):
+        """
+        Parameters shared by every event sent while handling the current request.
+        
+        Built on first use and memoised on flask.g, so several events from one
+        request (page_view and view_item on a product page) pay for the URL,
+        user agent, session and timestamp lookups once. Events from the same
+        request share the timestamp of the first one.
+        """
+        # g can outlive a request when an app context was pushed beforehand,
+        # so the memo is only valid for the request that built it
+        current_request = request._get_current_object()
+        memo = g.get('_gtm_event_context')
+        if memo is not None and memo[0] is self and memo[1] is current_request:
+            return memo[2]
+        
         if 'client_id' not in session:
             session['client_id'] = str(uuid.uuid4())
-        return session['client_id']
-    
-    def _prepare_event(self, event_name, event_data=None):
-        """Prepare event data with common parameters."""
-        if event_data is None:
-            event_data = {}
-            
-        # Add basic information
-        event_data.update({
-            'event': event_name,
-            'client_id': self._get_client_id(),
+        context = {
+            'client_id': session['client_id'],
             'page_location': request.url,
             'page_path': request.path,
             'page_referrer': request.referrer or '',
@@ -86,12 +226,22 @@ class GTMServerSide:
             'timestamp': datetime.utcnow().isoformat(),
             'ip_override': request.remote_addr,
             'container_id': self.container_id
-        })
+        }
         
         # Add user ID if available
         if hasattr(g, 'user') and g.user:
-            event_data['user_id'] = g.user.id
-            
+            context['user_id'] = g.user.id
+        
+        g._gtm_event_context = (self, current_request, context)
+        return context
+    
+    def _prepare_event(self, event_name, event_data=None):
+        """Prepare event data with common parameters."""
+        if event_data is None:
+            event_data = {}
+        
+        event_data['event'] = event_name
+        event_data.update(self._request_context())
         return event_data
     
     def send_event(self, event_name, event_data=None):
@@ -103,29 +253,112 @@ class GTMServerSide:
             event_data (dict, optional): Additional event data
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if successful (or queued for background dispatch), False if
+                delivery failed or the event was a duplicate, sampled out or rate limited
         """
+        started = time.perf_counter()
+        prepared_data = self.prepare_event(event_name, event_data)
+        if prepared_data is None:
+            return False
+        ok = self.send_prepared(event_name, prepared_data)
+        SEND_DURATION.observe(time.perf_counter() - started, event_name=event_name)
+        return ok
+    
+    def prepare_event(self, event_name, event_data=None):
+        """
+        Run the part of send_event that needs the request context.
+        
+        Duplicates, sampled-out and rate-limited events are counted and
+        dropped here, before any preparation work.
+        
+        Returns:
+            dict: Prepared event data to pass to send_prepared, or None if the
+                event is not to be sent
+        """
+        started = time.perf_counter()
+        
+        # Dropped events are only counted: no preparation, history or delivery
+        if self.deduplicator and self.deduplicator.is_duplicate(
+                event_name, event_data, self._get_client_id(), request.full_path):
+            EVENTS.inc(event_name=event_name, outcome='duplicate')
+            return None
+        if self.sampler:
+            reason = self.sampler.check(event_name, self._get_client_id())
+            if reason:
+                EVENTS.inc(event_name=event_name, outcome=reason)
+                return None
+        
         if not self.is_provisioned and self.container_config:
             self.manual_provision()
             
         prepared_data = self._prepare_event(event_name, event_data)
+        PREPARE_DURATION.observe(time.perf_counter() - started, event_name=event_name)
+        return prepared_data
+    
+    def send_prepared(self, event_name, prepared_data):
+        """
+        Record a prepared event and hand it to delivery.
         
+        Does not touch the request context, so it can run after the response
+        has been sent.
+        
+        Returns:
+            bool: True if successful (or queued for background dispatch), False otherwise
+        """
         # Store in event history for debug interface
         event_record = {
             'timestamp': datetime.utcnow().isoformat(),
             'event_name': event_name,
             'data': prepared_data
         }
-        self.event_history.insert(0, event_record)
-        if len(self.event_history) > self.max_history_size:
-            self.event_history.pop()
+        self.event_history.append(event_record)
+        self.broadcaster.publish(event_record)
         
-        # Construct the endpoint URL
+        if self.dispatcher:
+            ok = self.dispatcher.submit(event_name, prepared_data)
+            outcome = 'queued' if ok else 'rejected'
+        else:
+            ok = self._transmit(event_name, prepared_data)
+            outcome = 'sent' if ok else 'failed'
+        EVENTS.inc(event_name=event_name, outcome=outcome)
+        return ok
+    
+    def _transmit(self, event_name, prepared_data):
+        """
+        Hand a prepared event to the batcher, or POST it on its own.
+        
+        Runs on the request thread when dispatching is disabled, otherwise on a
+        dispatch worker, so it must not touch the Flask request context.
+        """
+        if self.batcher:
+            return self.batcher.add(event_name, prepared_data)
+        if self._deliver(event_name, prepared_data):
+            return True
+        self._spool_event(event_name, prepared_data)
+        return False
+    
+    def _spool_event(self, event_name, prepared_data):
+        """Keep an undeliverable event on disk for later replay."""
+        if not self.spool:
+            return
+        try:
+            self.spool.append(event_name, prepared_data)
+        except Exception as e:
+            logger.error(f"Failed to spool event {event_name}: {str(e)}")
+    
+    def _on_batch_result(self, event_name, prepared_data, ok):
+        if not ok:
+            self._spool_event(event_name, prepared_data)
+    
+    def _collect_url(self):
+        """Construct the endpoint URL."""
         url = f"{self.gtm_server_url}/collect"
         if self.api_secret:
             url += f"?api_secret={self.api_secret}"
-        
-        # Add container config as a header if available
+        return url
+    
+    def _headers(self, content_encoding=None):
+        """Build request headers, adding the container config and body encoding if needed."""
         headers = {
             'Content-Type': 'application/json',
             'User-Agent': 'GTMServerSide-Flask/1.0'
@@ -133,13 +366,25 @@ class GTMServerSide:
         
         if self.container_config:
             headers['X-GTM-Container-Config'] = self.container_config
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        return headers
+    
+    def _deliver(self, event_name, prepared_data):
+        """
+        POST a single prepared event to the GTM server.
         
+        Returns:
+            bool: True if successful, False otherwise
+        """
         try:
-            response = requests.post(
-                url,
-                json=prepared_data,
-                headers=headers
+            body, content_encoding = self.encoder.encode(prepared_data)
+            response = self.http.post(
+                self._collect_url(),
+                data=body,
+                headers=self._headers(content_encoding)
             )
+            UPSTREAM_RESPONSES.inc(kind='single', status=response.status_code)
             
             if response.status_code == 200 or response.status_code == 204:
                 logger.info(f"Event {event_name} sent successfully")
@@ -149,9 +394,77 @@ class GTMServerSide:
                 return False
                 
         except Exception as e:
+            UPSTREAM_RESPONSES.inc(kind='single', status='error')
             logger.error(f"Exception while sending event {event_name}: {str(e)}")
             return False
     
+    def _deliver_batch(self, body, events):
+        """
+        POST a batch payload to the GTM server.
+        
+        The tagging server may answer with {"results": [{"status": <code>}, ...]}
+        to report the outcome of each event; otherwise the HTTP status applies
+        to every event in the batch.
+        
+        Returns:
+            list: One bool per event, True if that event was accepted
+        """
+        try:
+            body, content_encoding = self.encoder.compress(body)
+            response = self.http.post(
+                self._collect_url(),
+                data=body,
+                headers=self._headers(content_encoding)
+            )
+        except Exception as e:
+            UPSTREAM_RESPONSES.inc(kind='batch', status='error')
+            logger.error(f"Exception while sending batch of {len(events)} events: {str(e)}")
+            return [False] * len(events)
+        UPSTREAM_RESPONSES.inc(kind='batch', status=response.status_code)
+        
+        if response.status_code not in (200, 204, 207):
+            logger.error(f"Failed to send batch of {len(events)} events. Status: {response.status_code}, Response: {response.text}")
+            return [False] * len(events)
+        
+        results = None
+        if response.content:
+            try:
+                results = response.json().get('results')
+            except (ValueError, AttributeError):
+                results = None
+        
+        if not isinstance(results, list) or len(results) != len(events):
+            logger.info(f"Batch of {len(events)} events sent successfully")
+            return [True] * len(events)
+        
+        return [isinstance(r, dict) and r.get('status') in (200, 204) for r in results]
+    
+    def delivery_stats(self):
+        """Return connection pool, dispatch queue, batching, spool, sampling and dedup statistics."""
+        return {
+            'http': self.http.stats(),
+            'dispatch': self.dispatcher.stats() if self.dispatcher else None,
+            'batch': self.batcher.stats() if self.batcher else None,
+            'spool': self.spool.stats() if self.spool else None,
+            'sampling': self.sampler.stats() if self.sampler else None,
+            'dedup': self.deduplicator.stats() if self.deduplicator else None,
+            'stream': self.broadcaster.stats()
+        }
+    
+    def shutdown(self, timeout=5.0):
+        """Drain queued events and flush pending batches before the process exits."""
+        drained = True
+        if self.dispatcher:
+            drained = self.dispatcher.shutdown(timeout)
+        if self.batcher:
+            self.batcher.close()
+        if self.replayer:
+            self.replayer.stop()
+        if self.spool:
+            self.spool.close()
+        self.http.close()
+        return drained
+    
     def get_recent_events(self, event_type=None, limit=10):
         """Return recent events for the debug interface.
         
@@ -162,10 +475,35 @@ class GTMServerSide:
         Returns:
             list: Recent events
         """
-        if event_type:
-            filtered_events = [event for event in self.event_history if event['event_name'] == event_type]
-            return filtered_events[:limit]
-        return self.event_history[:limit]
+        return self.event_history.latest(limit, event_type)
+    
+    def get_events_since(self, cursor, limit=100):
+        """Return the oldest events recorded after sequence number cursor.
+        
+        Call again with the last returned sequence number to page through
+        more than limit events.
+        
+        Args:
+            cursor (int): Last sequence number already seen (-1 for none)
+            limit (int): Maximum number of events to return
+            
+        Returns:
+            tuple: (new events oldest first, number of events after cursor
+                that dropped out of the history before they were read)
+        """
+        return self.event_history.since(cursor, limit)
+    
+    def subscribe(self, event_names=None, max_buffer=100):
+        """Subscribe to events as they are sent.
+        
+        Args:
+            event_names (list, optional): Only receive these event names
+            max_buffer (int): Undelivered events allowed before the subscriber is evicted
+            
+        Returns:
+            Subscription: Call get() to wait for events and close() when done
+        """
+        return self.broadcaster.subscribe(event_names, max_buffer)
     
     def track_pageview(self):
         """Track a pageview event."""
@@ -200,11 +538,42 @@ class GTMServerSide:
 
 # Decorator for automatic page view tracking
 def track_pageview(gtm_instance):
+    """
+    Report a page_view for every response of the decorated view.
+    
+    The event is prepared while the request context is still available, but
+    recorded and dispatched from the response's close callback, after the
+    last byte has been sent, so the visitor never waits for tracking. The
+    event carries the final status code and the time to last byte. Requests
+    with a method outside pageview_methods or a status in
+    pageview_skip_statuses (redirects, failed form posts) are not reported.
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            result = f(*args, **kwargs)
-            gtm_instance.track_pageview()
-            return result
+            started = time.perf_counter()
+            response = make_response(f(*args, **kwargs))
+            if (request.method not in gtm_instance.pageview_methods
+                    or response.status_code in gtm_instance.pageview_skip_statuses):
+                return response
+            
+            tracking_started = time.perf_counter()
+            prepared_data = gtm_instance.prepare_event('page_view', {
+                'page_title': request.endpoint,
+                'status_code': response.status_code
+            })
+            PAGEVIEW_DURATION.observe(time.perf_counter() - tracking_started)
+            if prepared_data is None:
+                return response
+            
+            def send_after_response():
+                prepared_data['response_time_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                try:
+                    gtm_instance.send_prepared('page_view', prepared_data)
+                except Exception as e:
+                    logger.error(f"Failed to send deferred page_view: {str(e)}")
+            
+            response.call_on_close(send_after_response)
+            return response
         return decorated_function
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,105 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('gtm_server')
+
+
+class PooledSession:
+    def __init__(self, pool_size=10, keep_alive=True, connect_timeout=2.0, read_timeout=5.0,
+                 retries=2, backoff_factor=0.2, pool_block=False):
+        """
+        requests.Session with a bounded keep-alive connection pool and timeouts.
+
+        Only connection failures are retried: the request never reached the
+        server, so resending is safe. Read timeouts and error statuses are not
+        retried because the event may already have been collected.
+
+        Args:
+            pool_size (int): Maximum connections kept per host
+            keep_alive (bool): Reuse connections between requests
+            connect_timeout (float): Seconds to wait for the TCP/TLS handshake
+            read_timeout (float): Seconds to wait for the response
+            retries (int): Retries for connection failures
+            backoff_factor (float): Backoff between retries (factor * 2 ** (retry - 1))
+            pool_block (bool): Wait for a free connection instead of opening an extra one
+        """
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+            pool_block=pool_block
+        )
+
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self._lock = threading.Lock()
+        self.timeouts = 0
+
+    def post(self, url, **kwargs):
+        """POST through the pool, applying the configured timeouts."""
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            return self.session.post(url, **kwargs)
+        except requests.Timeout:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def stats(self):
+        """
+        Return connection pool statistics.
+
+        Returns:
+            dict: open_connections, requests, handshakes (new connections opened),
+                reuse_ratio (share of requests served on an existing connection)
+                and timeouts
+        """
+        open_connections = 0
+        handshakes = 0
+        total_requests = 0
+
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            handshakes += pool.num_connections
+            total_requests += pool.num_requests
+            idle = list(pool.pool.queue) if pool.pool is not None else []
+            checked_out = pool.pool.maxsize - len(idle) if pool.pool is not None else 0
+            open_connections += checked_out + sum(1 for conn in idle if conn is not None and conn.sock is not None)
+
+        reuse_ratio = (total_requests - handshakes) / total_requests if total_requests else 0.0
+        return {
+            'pool_size': self.pool_size,
+            'keep_alive': self.keep_alive,
+            'open_connections': open_connections,
+            'requests': total_requests,
+            'handshakes': handshakes,
+            'reuse_ratio': round(max(reuse_ratio, 0.0), 4),
+            'timeouts': self.timeouts
+        }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,197 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger('gtm_server')
+
+ALLOWED_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+
+
+class ImagePipeline:
+    def __init__(self, directory, variants=None, webp=True, jpeg_quality=82, webp_quality=80,
+                 workers=2, on_complete=None):
+        """
+        Store uploaded product images under content-hashed names and build
+        resized variants in the background.
+
+        An upload is written as <digest>.<ext> straight away. The variants
+        (<digest>-<variant>.jpg and, with webp, <digest>-<variant>.webp) are
+        produced on a worker thread, followed by <digest>.json recording the
+        width each variant actually came out at, so the admin request only pays for
+        hashing and one write. Until they exist, and for images stored before
+        this pipeline, the helpers fall back to the original file. Every name
+        is derived from the content, so files never change and can be cached
+        forever.
+
+        Pillow is optional. Without it only originals are stored.
+
+        Args:
+            directory (str): Where originals and variants are written
+            variants (dict, optional): {variant name: maximum width and height in pixels}.
+                Images are never upscaled, so a variant may be smaller
+            webp (bool): Also write a WebP copy of every variant
+            jpeg_quality (int): JPEG quality of the variants
+            webp_quality (int): WebP quality of the variants
+            workers (int): Threads resizing images
+            on_complete (callable, optional): Called with the digest once its
+                variants are written, e.g. to drop cached pages that point at
+                the original
+        """
+        self.directory = directory
+        self.variants = dict(variants or {'thumb': 100, 'card': 400, 'full': 1200})
+        self.webp = webp
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+        self.on_complete = on_complete
+        os.makedirs(directory, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+        self._widths = {}
+        self._lock = threading.Lock()
+        if Image is None:
+            logger.warning("Pillow is not installed, product images are stored without resized variants")
+
+    @staticmethod
+    def extension(filename):
+        """Normalised extension of an upload, or None if it is not an accepted image type."""
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if ext not in ALLOWED_EXTENSIONS:
+            return None
+        return 'jpg' if ext == 'jpeg' else ext
+
+    def save_upload(self, data, filename):
+        """
+        Store an uploaded image and schedule its variants.
+
+        Args:
+            data (bytes): File contents
+            filename (str): Name the file was uploaded with, used for its extension
+
+        Returns:
+            str: Stored name to keep on the product, or None if the type is not accepted
+        """
+        ext = self.extension(filename)
+        if ext is None:
+            return None
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        name = f"{digest}.{ext}"
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            self._write(path, data)
+        if Image is not None and not self.has_variants(name):
+            self._executor.submit(self._build_variants, digest, data)
+        return name
+
+    def _write(self, path, data):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _build_variants(self, digest, data):
+        try:
+            with Image.open(io.BytesIO(data)) as original:
+                image = ImageOps.exif_transpose(original)
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                widths = {}
+                for variant, size in self.variants.items():
+                    resized = image.copy()
+                    resized.thumbnail((size, size), Image.LANCZOS)
+                    widths[variant] = resized.size[0]
+                    formats = [('jpg', 'JPEG', {'quality': self.jpeg_quality, 'optimize': True, 'progressive': True})]
+                    if self.webp:
+                        formats.append(('webp', 'WEBP', {'quality': self.webp_quality, 'method': 4}))
+                    for ext, fmt, options in formats:
+                        buffer = io.BytesIO()
+                        resized.save(buffer, fmt, **options)
+                        self._write(os.path.join(self.directory, f"{digest}-{variant}.{ext}"), buffer.getvalue())
+            self._write(os.path.join(self.directory, f"{digest}.json"), json.dumps(widths).encode())
+        except Exception as e:
+            logger.error(f"Failed to build image variants for {digest}: {str(e)}")
+            return
+        with self._lock:
+            self._widths[digest] = widths
+        if self.on_complete:
+            self.on_complete(digest)
+
+    @staticmethod
+    def _digest(name):
+        stem = name.rsplit('.', 1)[0]
+        return stem if len(stem) == 20 and all(c in '0123456789abcdef' for c in stem) else None
+
+    def _variant_widths(self, digest):
+        """{variant: width in pixels} of a complete set of variants, or None if it is not on disk."""
+        widths = self._widths.get(digest)
+        if widths is not None:
+            return widths
+        try:
+            with open(os.path.join(self.directory, f"{digest}.json")) as f:
+                widths = json.load(f)
+        except (OSError, ValueError):
+            # Sets built before the widths were recorded: the last variant file marks them complete
+            last_variant = list(self.variants)[-1]
+            last_ext = 'webp' if self.webp else 'jpg'
+            if not os.path.exists(os.path.join(self.directory, f"{digest}-{last_variant}.{last_ext}")):
+                return None
+            widths = {}
+            for variant, size in self.variants.items():
+                try:
+                    # Only reads the header
+                    with Image.open(os.path.join(self.directory, f"{digest}-{variant}.jpg")) as image:
+                        widths[variant] = image.size[0]
+                except Exception:
+                    widths[variant] = size
+        with self._lock:
+            self._widths[digest] = widths
+        return widths
+
+    def has_variants(self, name):
+        """True if the stored image has its resized variants on disk."""
+        digest = self._digest(name)
+        return digest is not None and self._variant_widths(digest) is not None
+
+    def variant_name(self, name, variant='full', fmt='jpg'):
+        """
+        File name of one variant of a stored image.
+
+        Returns:
+            str: The variant, the original while variants are missing, or None
+                for images not stored by the pipeline
+        """
+        if self.has_variants(name):
+            return f"{self._digest(name)}-{variant}.{fmt}"
+        if self._digest(name):
+            return name
+        return None
+
+    def srcset_entries(self, name, fmt='jpg'):
+        """
+        (file name, width) of every variant, smallest first, or [] without
+        variants. Widths are the variants' real widths; variants that came
+        out the same width as a smaller one, because the original was
+        smaller than both, are listed once.
+        """
+        if not self.has_variants(name) or (fmt == 'webp' and not self.webp):
+            return []
+        digest = self._digest(name)
+        widths = self._variant_widths(digest)
+        entries = []
+        for variant, _ in sorted(self.variants.items(), key=lambda v: v[1]):
+            width = widths.get(variant)
+            if width is None or (entries and width <= entries[-1][1]):
+                continue
+            entries.append((f"{digest}-{variant}.{fmt}", width))
+        return entries
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,298 @@
+import io
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from utils.ratelimit import KeyedRateLimiter
+from utils.spool import EventSpool
+
+logger = logging.getLogger('gtm_server')
+
+# field -> (accepted types, required)
+EVENT_SCHEMA = {
+    'event': (str, True),
+    'client_id': (str, True),
+    'timestamp': ((str, int, float), False),
+    'page_location': (str, False),
+    'page_path': (str, False),
+    'page_referrer': (str, False),
+    'page_title': (str, False),
+    'user_id': ((str, int), False),
+    'transaction_id': (str, False),
+    'value': ((int, float), False),
+    'currency': (str, False),
+    'items': (list, False),
+    'params': (dict, False)
+}
+REQUIRED_FIELDS = tuple(name for name, (_, required) in EVENT_SCHEMA.items() if required)
+MAX_EVENT_NAME_LENGTH = 64
+
+
+def validate_event(event):
+    """
+    Check an event against EVENT_SCHEMA. Unknown fields are allowed.
+
+    Returns:
+        str: Description of the first problem found, or None if the event is valid
+    """
+    if not isinstance(event, dict):
+        return "event must be a JSON object"
+    for name in REQUIRED_FIELDS:
+        if name not in event:
+            return f"missing field '{name}'"
+    for name, value in event.items():
+        spec = EVENT_SCHEMA.get(name)
+        if spec is not None and (not isinstance(value, spec[0]) or isinstance(value, bool)):
+            return f"field '{name}' has the wrong type"
+    if not event['event'] or len(event['event']) > MAX_EVENT_NAME_LENGTH:
+        return "field 'event' must be 1-64 characters"
+    return None
+
+
+class MemorySink:
+    def __init__(self, capacity=10000):
+        """Keep the most recent events in memory, mainly for development and tests."""
+        self.events = deque(maxlen=capacity)
+
+    def write(self, events):
+        count = 0
+        for event, _ in events:
+            self.events.append(event)
+            count += 1
+        return count
+
+
+class SQLiteSink:
+    def __init__(self, path, pool_size=4):
+        """
+        Append events to an SQLite table, one executemany per request.
+
+        The raw JSON line is stored as-is, so NDJSON input is never re-encoded.
+
+        Connections come from a small pool shared by all threads, not one
+        per thread: a thread-per-request server would otherwise open a new
+        connection, with its PRAGMAs, for every request.
+
+        Args:
+            path (str): Database file
+            pool_size (int): Connections kept open between requests
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._closed = False
+        conn = self._acquire()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS collected_event ("
+                "id INTEGER PRIMARY KEY, received_at REAL NOT NULL, event TEXT NOT NULL, "
+                "client_id TEXT NOT NULL, payload TEXT NOT NULL)"
+            )
+            conn.commit()
+        finally:
+            self._release(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def write(self, events):
+        received_at = time.time()
+        rows = (
+            (received_at, event['event'], event['client_id'],
+             raw.decode('utf-8') if raw is not None else json.dumps(event, separators=(',', ':')))
+            for event, raw in events
+        )
+        conn = self._acquire()
+        try:
+            with conn:
+                cursor = conn.executemany(
+                    "INSERT INTO collected_event (received_at, event, client_id, payload) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        finally:
+            self._release(conn)
+        return cursor.rowcount
+
+    def close(self):
+        """Close the pooled connections. Connections in use are closed when they are returned."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SpoolSink:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024):
+        """Append events to an EventSpool for durable, replayable storage."""
+        self.spool = EventSpool(directory, segment_bytes=segment_bytes)
+
+    def write(self, events):
+        count = 0
+        for event, raw in events:
+            if raw is None:
+                raw = json.dumps(event, separators=(',', ':')).encode('utf-8')
+            self.spool.append_raw(event['event'], raw)
+            count += 1
+        return count
+
+    def close(self):
+        self.spool.close()
+
+
+def build_sink(config):
+    """Create the sink named by config['sink']: 'memory', 'sqlite' or 'spool'."""
+    kind = config.get('sink', 'memory')
+    if kind == 'sqlite':
+        return SQLiteSink(config.get('sqlite_path', 'instance/collected_events.db'), config.get('sqlite_pool_size', 4))
+    if kind == 'spool':
+        return SpoolSink(config.get('spool_directory', 'spool/collect'))
+    if kind == 'memory':
+        return MemorySink(config.get('memory_capacity', 10000))
+    raise ValueError(f"Unknown ingest sink: {kind}")
+
+
+class CollectIngestor:
+    def __init__(self, sink, rate=1000, burst=None, max_event_bytes=8192, max_body_bytes=1024 * 1024,
+                 max_errors=10):
+        """
+        Parse, validate and rate-limit events posted to /collect and stream
+        them into a sink.
+
+        Args:
+            sink: Object with a write(iterable of (event, raw_bytes)) method
+            rate (float): Events per second allowed per client
+            burst (float, optional): Events a client may send at once
+            max_event_bytes (int): Largest accepted encoded event
+            max_body_bytes (int): Largest accepted JSON (non-NDJSON) body. NDJSON
+                is streamed, so only its lines are bounded
+            max_errors (int): Number of error messages reported back per request
+        """
+        self.sink = sink
+        self.limiter = KeyedRateLimiter(rate, burst)
+        self.max_event_bytes = max_event_bytes
+        self.max_body_bytes = max_body_bytes
+        self.max_errors = max_errors
+
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _parse(self, stream, content_type):
+        """Yield (event or None, raw bytes or None, error) for each event in the body."""
+        if isinstance(stream, io.RawIOBase):
+            # WSGI input streams read a byte at a time when iterated by line
+            stream = io.BufferedReader(stream, 64 * 1024)
+
+        if content_type in ('application/x-ndjson', 'application/jsonl'):
+            while True:
+                # Bounded reads, so an overlong line is never held in memory
+                line = stream.readline(self.max_event_bytes + 2)
+                if not line:
+                    return
+                if not line.endswith(b'\n') and len(line) > self.max_event_bytes:
+                    while line and not line.endswith(b'\n'):
+                        line = stream.readline(64 * 1024)
+                    yield None, None, "event too large"
+                    continue
+                line = line.strip()
+                if not line:
+                    continue
+                if len(line) > self.max_event_bytes:
+                    yield None, None, "event too large"
+                    continue
+                try:
+                    yield json.loads(line), line, None
+                except ValueError:
+                    yield None, None, "invalid JSON"
+            return
+
+        body = stream.read(self.max_body_bytes + 1)
+        if len(body) > self.max_body_bytes:
+            yield None, None, "body too large, send NDJSON to stream larger batches"
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            yield None, None, "invalid JSON"
+            return
+        if isinstance(payload, dict) and isinstance(payload.get('events'), list):
+            payload = payload['events']
+        if not isinstance(payload, list):
+            payload = [payload]
+        for event in payload:
+            yield event, None, None
+
+    def ingest(self, stream, content_type, client_key):
+        """
+        Ingest every event in a request body.
+
+        Args:
+            stream: File-like request body
+            content_type (str): MIME type without parameters
+            client_key (str): Key for per-client rate limiting, usually the client IP
+
+        Returns:
+            dict: accepted, rejected and rate_limited counts plus up to max_errors messages
+        """
+        result = {'accepted': 0, 'rejected': 0, 'rate_limited': 0, 'errors': []}
+
+        def valid_events():
+            for index, (event, raw, error) in enumerate(self._parse(stream, content_type)):
+                if error is None:
+                    error = validate_event(event)
+                if error is not None:
+                    result['rejected'] += 1
+                    if len(result['errors']) < self.max_errors:
+                        result['errors'].append({'index': index, 'error': error})
+                    continue
+                if not self.limiter.consume(client_key):
+                    result['rate_limited'] += 1
+                    continue
+                yield event, raw
+
+        result['accepted'] = self.sink.write(valid_events())
+        with self._lock:
+            self.accepted += result['accepted']
+            self.rejected += result['rejected']
+            self.rate_limited += result['rate_limited']
+        return result
+
+    def close(self):
+        """Close the sink, e.g. its database connection, if it has anything to close."""
+        close = getattr(self.sink, 'close', None)
+        if close is not None:
+            close()
+
+    def stats(self):
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'rate_limited': self.rate_limited,
+            'clients_tracked': len(self.limiter)
+        }
@@ -0,0 +1,117 @@
+"""
+Schema migrations for databases created before a model change.
+
+db.create_all() only creates missing tables, so constraints and indexes
+added to existing tables are applied here. Each migration runs once, in its
+own transaction, and is recorded in the schema_migrations table. Migrations
+must be idempotent: on a fresh database create_all() has usually built the
+same objects already.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, inspect, text
+
+logger = logging.getLogger('gtm_server')
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a function taking a Connection as migration number version."""
+    def decorator(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return function
+    return decorator
+
+
+def has_index(connection, table, columns, unique=False):
+    """True if table has an index or unique constraint on exactly these columns."""
+    inspector = inspect(connection)
+    columns = list(columns)
+    for index in inspector.get_indexes(table):
+        if index['column_names'] == columns and (index.get('unique') or not unique):
+            return True
+    for constraint in inspector.get_unique_constraints(table):
+        if constraint['column_names'] == columns:
+            return True
+    return False
+
+
+def create_index(connection, name, table, columns, unique=False):
+    """Create an index unless an equivalent one exists."""
+    if has_index(connection, table, columns, unique):
+        return
+    reflected = Table(table, MetaData(), autoload_with=connection)
+    Index(name, *(reflected.c[c] for c in columns), unique=unique).create(connection)
+
+
+@migration(1, "Unique (user_id, product_id) on cart_item")
+def unique_cart_items(connection):
+    # Fold duplicate rows into the oldest one before the constraint can be added
+    connection.execute(text("""
+        UPDATE cart_item SET quantity = (
+            SELECT SUM(d.quantity) FROM cart_item d
+            WHERE d.user_id = cart_item.user_id AND d.product_id = cart_item.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        )
+    """))
+    connection.execute(text("""
+        DELETE FROM cart_item WHERE id NOT IN (
+            SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM cart_item GROUP BY user_id, product_id) k
+        )
+    """))
+    create_index(connection, 'uq_cart_item_user_product', 'cart_item', ('user_id', 'product_id'), unique=True)
+
+
+@migration(2, "Indexes on order.user_id, order.date_ordered and order_item.order_id")
+def order_indexes(connection):
+    create_index(connection, 'ix_order_user_id', 'order', ('user_id',))
+    create_index(connection, 'ix_order_date_ordered', 'order', ('date_ordered',))
+    create_index(connection, 'ix_order_item_order_id', 'order_item', ('order_id',))
+
+
+@migration(3, "Widen user.password_hash to 256 characters")
+def widen_password_hash(connection):
+    # SQLite does not enforce VARCHAR lengths
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(256)'))
+    elif dialect in ('mysql', 'mariadb'):
+        connection.execute(text('ALTER TABLE `user` MODIFY password_hash VARCHAR(256)'))
+
+
+def run_migrations(engine):
+    """
+    Apply every migration not yet recorded in schema_migrations.
+
+    Returns:
+        list: Versions applied by this call
+    """
+    _metadata.create_all(engine, tables=[schema_migrations])
+    with engine.connect() as connection:
+        applied = set(connection.execute(schema_migrations.select().with_only_columns(
+            schema_migrations.c.version)).scalars())
+
+    newly_applied = []
+    for version, description, function in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as connection:
+            function(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()))
+        logger.info(f"Applied migration {version}: {description}")
+        newly_applied.append(version)
+    return newly_applied
@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque URL-safe token."""
+    plain = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, columns):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Returns:
+        list: Sort key values, or None if the token is missing or malformed
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(columns):
+        return None
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and column.type.python_type is datetime:
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                return None
+        decoded.append(value)
+    return decoded
+
+
+def keyset_paginate(query, columns, after=None, limit=50, descending=False):
+    """
+    Fetch one page of a query using keyset (cursor) pagination.
+
+    Unlike OFFSET, the cost of a page does not grow with its position: the
+    database seeks straight to the first row after the cursor. The columns
+    must form a unique sort key, e.g. (date_ordered, id).
+
+    Args:
+        query: SQLAlchemy query to paginate
+        columns (list): Sort key columns
+        after (str, optional): Cursor returned with the previous page
+        limit (int): Page size
+        descending (bool): Sort newest/highest first
+
+    Returns:
+        tuple: (list of rows, cursor for the next page or None on the last page)
+    """
+    key = tuple_(*columns)
+    values = decode_cursor(after, columns)
+    if values is not None:
+        bound = tuple_(*values)
+        query = query.filter(key < bound if descending else key > bound)
+
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    return rows, next_cursor
@@ -0,0 +1,253 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from utils.metrics import Counter, Gauge
+from utils.ratelimit import KeyedRateLimiter
+
+logger = logging.getLogger('gtm_server')
+
+PASSWORD_HASHES = Counter(
+    'password_hash_operations_total', "Password hash and verify calls by outcome", ('operation', 'outcome'))
+PASSWORD_HASH_PENDING = Gauge(
+    'password_hash_pending', "Password hashes queued or running in the hashing pool")
+LOGIN_ATTEMPTS = Counter(
+    'login_attempts_total', "Login attempts by outcome", ('outcome',))
+
+
+class HasherBusy(Exception):
+    """The hashing queue is full, or a hash did not finish in time. Ask the client to retry."""
+
+
+def _method_prefix(method):
+    # Hashes start with the full method string, e.g. "scrypt:32768:8:1$salt$hash"
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt:32768:8:1', workers=2, max_pending=8, timeout=10.0):
+        """
+        Hash and verify passwords in a small process pool.
+
+        Each hash costs tens of milliseconds of CPU and, for scrypt, tens of
+        megabytes of memory. Running them in a fixed number of worker
+        processes keeps a burst of logins from occupying every request
+        thread, and max_pending bounds the queue so excess attempts are
+        rejected straight away instead of waiting behind it.
+
+        The pool forks its workers in start(). Call it at startup, before the
+        app starts background threads. It is never restarted later: forking
+        a process that is already running threads can deadlock the child,
+        and the spawn and forkserver start methods re-run the app's main
+        module in every worker. If a worker dies the pool is left broken,
+        every hash raises HasherBusy and the app needs restarting. With
+        workers=0 hashing runs inline, still subject to max_pending.
+
+        Args:
+            method (str): Werkzeug hash method, e.g. "scrypt:32768:8:1" or
+                "pbkdf2:sha256:600000". Stored hashes made with other
+                parameters are upgraded on the next successful login
+            workers (int): Hashing processes
+            max_pending (int): Hashes queued or running before new ones are rejected
+            timeout (float): Seconds a request waits for its hash
+        """
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.prefix = None
+
+        self._executor = None
+        self.broken = False
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        PASSWORD_HASH_PENDING.set_function(lambda: self.pending)
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(
+            method=config.get('method', 'scrypt:32768:8:1'),
+            workers=config.get('workers', 2),
+            max_pending=config.get('max_pending', 8),
+            timeout=config.get('timeout', 10.0)
+        )
+
+    def start(self):
+        """Start the worker processes and resolve the full method string."""
+        if self.workers <= 0:
+            self.prefix = _method_prefix(self.method)
+            return
+        methods = multiprocessing.get_all_start_methods()
+        # Forking avoids re-importing the app in every worker
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with self._lock:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        # Fork every worker now and check the method is valid
+        self.prefix = self._executor.submit(_method_prefix, self.method).result()
+
+    def _mark_broken(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            already_broken, self.broken = self.broken, True
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if not already_broken:
+            logger.error("Password hashing pool is broken, logins will fail until the app is restarted")
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def _run(self, operation, function, *args):
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_HASHES.inc(operation=operation, outcome='rejected')
+            raise HasherBusy(f"{self.max_pending} password hashes already pending")
+        with self._lock:
+            self.pending += 1
+
+        if self.workers <= 0:
+            try:
+                return function(*args)
+            finally:
+                self._release()
+                PASSWORD_HASHES.inc(operation=operation, outcome='done')
+
+        executor = self._executor
+        if executor is None:
+            # Not started, shut down or broken. Starting it now would fork a
+            # process that is already running threads.
+            self._release()
+            PASSWORD_HASHES.inc(operation=operation, outcome='failed')
+            state = 'broken' if self.broken else 'not running'
+            raise HasherBusy(f"password hashing pool is {state}")
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._mark_broken()
+            PASSWORD_HASHES.inc(operation=operation, outcome='failed')
+            raise HasherBusy("password hashing pool is broken")
+        # The slot is held until the worker is done, even if the caller gives up
+        future.add_done_callback(self._release)
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            PASSWORD_HASHES.inc(operation=operation, outcome='timeout')
+            raise HasherBusy(f"password hash took longer than {self.timeout}s")
+        except BrokenProcessPool:
+            self._mark_broken()
+            PASSWORD_HASHES.inc(operation=operation, outcome='failed')
+            raise HasherBusy("password hashing pool is broken")
+        PASSWORD_HASHES.inc(operation=operation, outcome='done')
+        return result
+
+    def hash(self, password):
+        """
+        Hash a password with the configured method.
+
+        Raises:
+            HasherBusy: Too many hashes pending, or it timed out
+        """
+        return self._run('hash', _hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """
+        Check a password against a stored hash.
+
+        Raises:
+            HasherBusy: Too many hashes pending, or it timed out
+        """
+        if not pwhash:
+            return False
+        return self._run('verify', _verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with a different method or parameters than configured."""
+        if self.prefix is None:
+            self.prefix = _method_prefix(self.method)
+        return pwhash.split('$', 1)[0] != self.prefix
+
+    def stats(self):
+        return {
+            'method': self.method,
+            'workers': self.workers,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'broken': self.broken
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class LoginLimiter:
+    def __init__(self, ip_rate=0.2, ip_burst=10, username_rate=0.05, username_burst=5, max_keys=10000):
+        """
+        Login throttling checked before any password is hashed, so a flood
+        is turned away cheaply.
+
+        Every attempt takes a token from its client IP's bucket up front,
+        which bounds how much hashing one address can queue; a successful
+        login gives it back. Failed attempts also take one from a bucket
+        keyed on (IP, username), which a successful login resets: repeated
+        guessing at one account from one address is slowed down, while the
+        account's owner, logging in from elsewhere or after getting the
+        password right, is not.
+
+        Args:
+            ip_rate (float): Attempts per second regained by each IP
+            ip_burst (float): Attempts an IP may make at once
+            username_rate (float): Failed attempts per second regained by each (IP, username)
+            username_burst (float): Failed attempts an IP may make on one username at once
+            max_keys (int): Buckets kept per kind
+        """
+        self.by_ip = KeyedRateLimiter(ip_rate, ip_burst, max_keys)
+        self.failures = KeyedRateLimiter(username_rate, username_burst, max_keys)
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(
+            ip_rate=config.get('ip_rate', 0.2),
+            ip_burst=config.get('ip_burst', 10),
+            username_rate=config.get('username_rate', 0.05),
+            username_burst=config.get('username_burst', 5),
+            max_keys=config.get('max_keys', 10000)
+        )
+
+    @staticmethod
+    def _key(ip, username):
+        return (ip or 'unknown', (username or '').strip().lower())
+
+    def allow(self, ip, username):
+        """Take one attempt from the IP's bucket. False if the IP or its failures on username are over the limit."""
+        if not self.failures.peek(self._key(ip, username)):
+            return False
+        return self.by_ip.consume(ip or 'unknown')
+
+    def failed(self, ip, username):
+        """Record a failed attempt on username from ip."""
+        self.failures.consume(self._key(ip, username))
+
+    def succeeded(self, ip, username):
+        """Refund the IP's attempt and clear the failures recorded for username from ip."""
+        self.by_ip.refund(ip or 'unknown')
+        self.failures.reset(self._key(ip, username))
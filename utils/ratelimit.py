@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """
+        Token bucket refilled continuously at a fixed rate.
+
+        Args:
+            rate (float): Tokens added per second
+            burst (float, optional): Bucket capacity, defaults to one second of tokens
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, n=1):
+        """
+        Take n tokens if they are available.
+
+        Returns:
+            bool: True if the tokens were taken, False if the caller is over the limit
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= n:
+                self.tokens -= n
+                return True
+            return False
+
+    def peek(self, n=1):
+        """True if n tokens are available, without taking them."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens >= n
+
+    def refund(self, n=1):
+        """Give back n tokens taken for work that turned out not to count."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def wait(self, n=1):
+        """Block until n tokens are available, then take them."""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                delay = (n - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class KeyedRateLimiter:
+    def __init__(self, rate, burst=None, max_keys=10000):
+        """
+        One TokenBucket per key (client, event type, ...), keeping at most
+        max_keys buckets by discarding the least recently used ones.
+
+        Args:
+            rate (float): Tokens added per second to each bucket
+            burst (float, optional): Capacity of each bucket
+            max_keys (int): Maximum number of buckets kept in memory
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, n=1):
+        """
+        Take n tokens from the bucket for key.
+
+        Returns:
+            bool: True if allowed, False if key is over its limit
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.consume(n)
+
+    def peek(self, key, n=1):
+        """True if key could take n tokens now, without taking them or creating a bucket."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+        return bucket is None or bucket.peek(n)
+
+    def refund(self, key, n=1):
+        """Give back n tokens to key's bucket, if it still has one."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.refund(n)
+
+    def reset(self, key):
+        """Forget key's bucket, giving it a full burst again."""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
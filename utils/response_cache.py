@@ -0,0 +1,76 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def strong_etag(body):
+    """Strong ETag for a rendered body: identical bytes, identical tag."""
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, max_entries=512):
+        """
+        LRU cache for rendered pages and template fragments.
+
+        Every lookup carries the current catalog version; when it changes,
+        all entries are dropped, so nothing rendered from an older catalog
+        is ever served.
+
+        Args:
+            max_entries (int): Maximum entries kept; least recently used are evicted
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key, version):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            self._check_version(version)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, version, value):
+        """
+        Store value for key if version is still current, and return it.
+
+        A render that finishes after an invalidation carries the old version:
+        its value is returned to the caller but not cached, and the entries
+        already cached for the new version are kept.
+        """
+        with self._lock:
+            if self._version is None:
+                self._version = version
+            elif version != self._version:
+                return value
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,130 @@
+import hashlib
+import threading
+
+from utils.ratelimit import TokenBucket, KeyedRateLimiter
+
+SAMPLED = 'sampled'
+EVENT_RATE_LIMITED = 'event_rate_limited'
+CLIENT_RATE_LIMITED = 'client_rate_limited'
+
+_HASH_SPACE = float(2 ** 64)
+
+
+def sample_fraction(event_name, client_id, salt=''):
+    """
+    Map (event name, client id) to a stable number in [0, 1).
+
+    The same client always lands on the same number for an event name, so a
+    client is either always kept or always dropped at a given sample rate.
+    """
+    key = f"{salt}:{event_name}:{client_id}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') / _HASH_SPACE
+
+
+class EventSampler:
+    def __init__(self, sample_rates=None, default_rate=1.0, event_limits=None, client_limits=None,
+                 always_send=('purchase',), max_clients=10000, salt=''):
+        """
+        Decide which events are sent upstream, before any work is spent on them.
+
+        Each check is skipped for event names in always_send. Otherwise an
+        event is dropped if its client falls outside the sample rate for the
+        event name, then if the client or the event type is over its token
+        bucket limit. Limits are looked up by event name, with '*' as the
+        fallback for names without their own entry.
+
+        Args:
+            sample_rates (dict, optional): Fraction of clients kept per event name
+            default_rate (float): Fraction kept for event names not in sample_rates
+            event_limits (dict, optional): {event name: {'rate': ..., 'burst': ...}}
+                shared by all clients
+            client_limits (dict, optional): {event name: {'rate': ..., 'burst': ...}}
+                applied to each client separately
+            always_send (iterable): Event names that are never sampled or limited
+            max_clients (int): Client buckets kept for each client_limits entry
+            salt (str): Changes which clients are kept without changing the rates
+        """
+        self.sample_rates = dict(sample_rates or {})
+        self.default_rate = default_rate
+        self.always_send = frozenset(always_send or ())
+        self.salt = salt
+
+        self.event_limits = dict(event_limits or {})
+        self._event_buckets = {}
+        self._client_limiters = {
+            name: KeyedRateLimiter(limit['rate'], limit.get('burst'), max_keys=max_clients)
+            for name, limit in (client_limits or {}).items()
+        }
+
+        self._lock = threading.Lock()
+        self.kept = {}
+        self.dropped = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a sampler from GTM_CONFIG['sampling'], or return None when it is disabled."""
+        if not config or not config.get('enabled'):
+            return None
+        return cls(
+            sample_rates=config.get('rates'),
+            default_rate=config.get('default_rate', 1.0),
+            event_limits=config.get('event_limits'),
+            client_limits=config.get('client_limits'),
+            always_send=config.get('always_send', ('purchase',)),
+            max_clients=config.get('max_clients', 10000),
+            salt=config.get('salt', '')
+        )
+
+    def _lookup(self, table, event_name):
+        found = table.get(event_name)
+        return found if found is not None else table.get('*')
+
+    def _event_bucket(self, event_name):
+        """Token bucket for an event type, created on first use so '*' gives each name its own."""
+        bucket = self._event_buckets.get(event_name)
+        if bucket is None:
+            limit = self._lookup(self.event_limits, event_name)
+            if limit is None:
+                return None
+            with self._lock:
+                bucket = self._event_buckets.setdefault(
+                    event_name, TokenBucket(limit['rate'], limit.get('burst')))
+        return bucket
+
+    def check(self, event_name, client_id):
+        """
+        Decide whether one event is sent and count the outcome.
+
+        Returns:
+            str: None if the event should be sent, otherwise why it was dropped
+                (SAMPLED, CLIENT_RATE_LIMITED or EVENT_RATE_LIMITED)
+        """
+        reason = None
+        if event_name not in self.always_send:
+            rate = self.sample_rates.get(event_name, self.default_rate)
+            if rate < 1.0 and sample_fraction(event_name, client_id, self.salt) >= rate:
+                reason = SAMPLED
+            else:
+                limiter = self._lookup(self._client_limiters, event_name)
+                if limiter is not None and not limiter.consume((event_name, client_id)):
+                    reason = CLIENT_RATE_LIMITED
+                else:
+                    bucket = self._event_bucket(event_name)
+                    if bucket is not None and not bucket.consume():
+                        reason = EVENT_RATE_LIMITED
+
+        with self._lock:
+            if reason is None:
+                self.kept[event_name] = self.kept.get(event_name, 0) + 1
+            else:
+                counts = self.dropped.setdefault(event_name, {})
+                counts[reason] = counts.get(reason, 0) + 1
+        return reason
+
+    def stats(self):
+        """Return kept and dropped counts per event name."""
+        with self._lock:
+            return {
+                'kept': dict(self.kept),
+                'dropped': {name: dict(counts) for name, counts in self.dropped.items()}
+            }
@@ -0,0 +1,381 @@
+"""
+Durable on-disk spool for tracking events that could not be delivered.
+
+Segments are append-only files of length-prefixed records:
+
+    <uint32 length><uint32 crc32><length bytes of JSON>
+
+A segment being written is held under an exclusive flock, so replayers and
+the CLI (in this or any other process) only ever touch sealed segments.
+Replay progress is kept in a small "<segment>.ack" file holding the byte
+offset of the first record that has not been delivered yet.
+
+Usage:
+    python -m utils.spool inspect [DIRECTORY]
+    python -m utils.spool compact [DIRECTORY]
+    python -m utils.spool replay [DIRECTORY] [--rate N] [--limit N]
+"""
+import argparse
+import fcntl
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from utils.ratelimit import TokenBucket
+
+logger = logging.getLogger('gtm_server')
+
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_SUFFIX = '.seg'
+ACK_SUFFIX = '.ack'
+
+# Shared by every EventSpool in the process, so a second spool on the same
+# directory (compact's target) never reuses a segment name in the same millisecond
+_segment_counter = itertools.count()
+
+
+def iter_records(path, start=0):
+    """
+    Yield (end_offset, payload) for every intact record in a segment.
+
+    Iteration stops at the first truncated or corrupt record, which is
+    what a crash in the middle of an append leaves behind.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = start
+            while offset + RECORD_HEADER.size <= size:
+                length, crc = RECORD_HEADER.unpack_from(data, offset)
+                end = offset + RECORD_HEADER.size + length
+                if end > size:
+                    return
+                payload = data[offset + RECORD_HEADER.size:end]
+                if zlib.crc32(payload) != crc:
+                    return
+                yield end, payload
+                offset = end
+
+
+def read_ack(path):
+    """Return the replay offset recorded for a segment."""
+    try:
+        with open(path + ACK_SUFFIX) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_ack(path, offset):
+    tmp = path + ACK_SUFFIX + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(str(offset))
+    os.replace(tmp, path + ACK_SUFFIX)
+
+
+def remove_segment(path):
+    for name in (path, path + ACK_SUFFIX):
+        try:
+            os.unlink(name)
+        except FileNotFoundError:
+            pass
+
+
+class claim_segment:
+    """Context manager that locks a sealed segment, yielding None if it is in use."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._release()
+            return None
+        # Another replayer may have finished and unlinked the segment between
+        # our open and flock; its ack is gone too, so replaying the orphaned
+        # inode would resend every record
+        opened = os.fstat(self.file.fileno())
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+            self._release()
+            return None
+        return self.path
+
+    def _release(self):
+        self.file.close()
+        self.file = None
+
+    def __exit__(self, *exc):
+        if self.file:
+            self.file.close()
+        return False
+
+
+class EventSpool:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, fsync=False):
+        """
+        Append-only, segment-rotated spool of prepared events.
+
+        Args:
+            directory (str): Directory holding the segment files
+            segment_bytes (int): Size at which the active segment is sealed
+            fsync (bool): fsync after every record. Off by default: records are
+                flushed to the OS on every append, which survives a process crash
+                and keeps appends in the microsecond range.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+        self._active_size = 0
+
+        self.records_written = 0
+        self.bytes_written = 0
+
+    def _open_segment(self):
+        name = f"{int(time.time() * 1000):013d}-{os.getpid()}-{next(_segment_counter):06d}{SEGMENT_SUFFIX}"
+        self._active_path = os.path.join(self.directory, name)
+        self._active = open(self._active_path, 'ab')
+        fcntl.flock(self._active.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._active_size = 0
+
+    def append(self, event_name, prepared_data):
+        """Write one event to the active segment."""
+        self.append_raw(event_name, json.dumps(prepared_data, separators=(',', ':')).encode('utf-8'))
+
+    def append_raw(self, event_name, encoded_data):
+        """Write one event whose data is already JSON-encoded, without re-encoding it."""
+        payload = b'{"event_name":' + json.dumps(event_name).encode('utf-8') + b',"data":' + encoded_data + b'}'
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            if self._active is None or self._active_size + len(record) > self.segment_bytes:
+                self._seal()
+                self._open_segment()
+            self._active.write(record)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self._active_size += len(record)
+            self.records_written += 1
+            self.bytes_written += len(record)
+
+    def _seal(self):
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+            self._active_path = None
+
+    def seal(self):
+        """Close the active segment so it can be replayed."""
+        with self._lock:
+            self._seal()
+
+    def segments(self):
+        """Return all segment paths, oldest first."""
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def stats(self):
+        """Return spool counters for monitoring."""
+        segments = self.segments()
+        return {
+            'segments': len(segments),
+            'bytes_on_disk': sum(os.path.getsize(p) for p in segments if os.path.exists(p)),
+            'records_written': self.records_written,
+            'bytes_written': self.bytes_written
+        }
+
+    def close(self):
+        self.seal()
+
+
+def replay_segments(spool, send, bucket=None, limit=None):
+    """
+    Re-send spooled events, oldest first.
+
+    Stops at the first failed delivery so ordering is preserved and the
+    upstream is not hammered while it is still down.
+
+    Args:
+        spool (EventSpool): Spool to replay
+        send (callable): Called as send(event_name, prepared_data), returns bool
+        bucket (TokenBucket, optional): Rate limit for re-sent events
+        limit (int, optional): Maximum number of events to re-send
+
+    Returns:
+        tuple: (events sent, True if every pending record was delivered)
+    """
+    sent = 0
+    for path in spool.segments():
+        with claim_segment(path) as claimed:
+            if not claimed:
+                continue
+            offset = read_ack(path)
+            for end, payload in iter_records(path, offset):
+                if limit is not None and sent >= limit:
+                    write_ack(path, offset)
+                    return sent, False
+                if bucket:
+                    bucket.wait()
+                try:
+                    record = json.loads(payload)
+                    ok = send(record['event_name'], record['data'])
+                except (ValueError, KeyError):
+                    logger.error(f"Skipping unreadable spool record in {path} at {offset}")
+                    ok = True
+                if not ok:
+                    write_ack(path, offset)
+                    return sent, False
+                sent += 1
+                offset = end
+            remove_segment(path)
+    return sent, True
+
+
+class SpoolReplayer:
+    def __init__(self, spool, send, rate=50, interval=5.0, max_interval=300.0):
+        """
+        Background thread that replays the spool once the upstream recovers.
+
+        Args:
+            spool (EventSpool): Spool to replay
+            send (callable): Called as send(event_name, prepared_data), returns bool
+            rate (float): Maximum events re-sent per second
+            interval (float): Seconds between replay attempts
+            max_interval (float): Upper bound for the backoff after failed attempts
+        """
+        self.spool = spool
+        self.send = send
+        self.bucket = TokenBucket(rate)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.replayed = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="gtm-spool-replayer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.wait(delay):
+            self.spool.seal()
+            try:
+                sent, complete = replay_segments(self.spool, self.send, self.bucket)
+            except Exception as e:
+                logger.error(f"Error while replaying spool: {str(e)}")
+                sent, complete = 0, False
+            self.replayed += sent
+            if sent:
+                logger.info(f"Replayed {sent} spooled events")
+            delay = self.interval if complete else min(delay * 2, self.max_interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(1.0)
+
+
+def inspect(spool):
+    """Print one line per segment with its record counts."""
+    print(f"{'segment':<40} {'bytes':>10} {'records':>8} {'pending':>8} {'corrupt':>8}  state")
+    for path in spool.segments():
+        with claim_segment(path) as claimed:
+            offset = read_ack(path)
+            total = pending = 0
+            end = 0
+            for end, _ in iter_records(path):
+                total += 1
+                if end > offset:
+                    pending += 1
+            size = os.path.getsize(path)
+            state = 'sealed' if claimed else 'active'
+            print(f"{os.path.basename(path):<40} {size:>10} {total:>8} {pending:>8} {size - end:>8}  {state}")
+
+
+def compact(spool):
+    """
+    Rewrite sealed segments, dropping delivered and corrupt records and
+    merging small segments into as few files as possible.
+
+    Returns:
+        tuple: (segments removed, records kept)
+    """
+    removed = kept = 0
+    target = EventSpool(spool.directory, spool.segment_bytes, fsync=True)
+    for path in spool.segments():
+        with claim_segment(path) as claimed:
+            if not claimed:
+                continue
+            for _, payload in iter_records(path, read_ack(path)):
+                event_name = json.loads(payload)['event_name']
+                # Copy the encoded data as it is; payloads are written by append_raw
+                prefix = b'{"event_name":' + json.dumps(event_name).encode('utf-8') + b',"data":'
+                if payload.startswith(prefix) and payload.endswith(b'}'):
+                    target.append_raw(event_name, payload[len(prefix):-1])
+                else:
+                    target.append(event_name, json.loads(payload)['data'])
+                kept += 1
+            remove_segment(path)
+            removed += 1
+    target.close()
+    return removed, kept
+
+
+def main(argv=None):
+    from utils.config import GTM_CONFIG
+
+    default_directory = GTM_CONFIG.get('spool', {}).get('directory', 'spool')
+    parser = argparse.ArgumentParser(description="Inspect, compact and replay the GTM event spool")
+    parser.add_argument('command', choices=['inspect', 'compact', 'replay'])
+    parser.add_argument('directory', nargs='?', default=default_directory)
+    parser.add_argument('--rate', type=float, default=50, help="events per second (replay)")
+    parser.add_argument('--limit', type=int, default=None, help="maximum events to re-send (replay)")
+    args = parser.parse_args(argv)
+
+    spool = EventSpool(args.directory)
+    if args.command == 'inspect':
+        inspect(spool)
+    elif args.command == 'compact':
+        removed, kept = compact(spool)
+        print(f"Compacted {removed} segments, {kept} records kept")
+    else:
+        from utils.gtm_server import GTMServerSide
+
+        gtm = GTMServerSide(
+            gtm_server_url=GTM_CONFIG['server_url'],
+            container_id=GTM_CONFIG['container_id'],
+            api_secret=GTM_CONFIG.get('api_secret'),
+            container_config=GTM_CONFIG.get('container_config'),
+            http_config=GTM_CONFIG.get('http')
+        )
+        sent, complete = replay_segments(spool, gtm._deliver, TokenBucket(args.rate), args.limit)
+        print(f"Replayed {sent} events{'' if complete else ', stopped before the end of the spool'}")
+        gtm.shutdown()
+        return 0 if complete else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Opt-in SQL profiler: per-request query counts, DB time and duplicate
+statements, plus a slow-query log with the database's query plan.
+
+Meant for development and staging. Every statement is timed and, while a
+request is active, recorded against it; statements slower than the
+threshold are EXPLAINed on the same connection and logged, and full table
+scans in their plans are counted per table so missing indexes stand out.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('gtm_server')
+
+# How each dialect asks for a plan, and how a full table scan shows up in it
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+    'mariadb': 'EXPLAIN ',
+}
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?(?: AS \w+)?$')
+POSTGRES_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def _normalise(statement):
+    return WHITESPACE.sub(' ', statement).strip()
+
+
+class RequestProfile:
+    """Statements executed while handling one request."""
+
+    __slots__ = ('count', 'seconds', 'statements', 'duplicates')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.duplicates = 0
+
+    def record(self, statement, parameters, seconds):
+        self.count += 1
+        self.seconds += seconds
+        try:
+            key = (statement, repr(parameters))
+        except Exception:
+            key = (statement, None)
+        if key in self.statements:
+            self.duplicates += 1
+        self.statements[key] += 1
+
+
+class SQLProfiler:
+    def __init__(self, slow_query_ms=100, explain=True, log_file=None, recent_requests=200,
+                 recent_slow_queries=50, duplicate_warning=5):
+        """
+        Profile SQL statements per request.
+
+        Args:
+            slow_query_ms (float): Statements taking at least this long are
+                logged as slow (0 logs every statement)
+            explain (bool): Log the query plan of slow SELECT statements
+            log_file (str, optional): Write the slow-query log to this file
+                instead of the application log
+            recent_requests (int): Requests kept for the per-endpoint summary
+            recent_slow_queries (int): Slow queries kept for the debug page
+            duplicate_warning (int): Warn when a request repeats identical
+                statements at least this many times (0 disables)
+        """
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self.explain = explain
+        self.duplicate_warning = duplicate_warning
+        self.requests = deque(maxlen=recent_requests)
+        self.slow_queries = deque(maxlen=recent_slow_queries)
+        self.table_scans = Counter()
+        self._lock = threading.Lock()
+
+        self.slow_log = logging.getLogger('gtm_server.slow_queries')
+        if log_file:
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.slow_log.addHandler(handler)
+            self.slow_log.setLevel(logging.INFO)
+            self.slow_log.propagate = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a profiler from DATABASE_CONFIG['profiler'], or return None when it is disabled."""
+        config = dict(config or {})
+        if not config.pop('enabled', False):
+            return None
+        return cls(**config)
+
+    def instrument(self, engine):
+        """Time every statement executed by engine."""
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('_profiler_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _record_statement(conn, cursor, statement, parameters, context, executemany):
+            stack = conn.info.get('_profiler_started')
+            if not stack:
+                return
+            seconds = time.perf_counter() - stack.pop()
+            if has_request_context():
+                profile = g.get('_sql_profile')
+                if profile is not None:
+                    profile.record(statement, parameters, seconds)
+            if seconds >= self.slow_query_seconds:
+                self._record_slow(conn, statement, parameters, seconds, executemany)
+
+        @event.listens_for(engine, 'handle_error')
+        def _discard_statement_timer(exception_context):
+            # after_cursor_execute does not run for a failed statement
+            conn = exception_context.connection
+            if conn is not None:
+                stack = conn.info.get('_profiler_started')
+                if stack:
+                    stack.pop()
+
+    def init_app(self, app):
+        """Start a profile for every request and summarise it once the response is ready."""
+
+        @app.before_request
+        def _start_request_profile():
+            g._sql_profile = RequestProfile()
+
+        @app.after_request
+        def _finish_request_profile(response):
+            profile = g.pop('_sql_profile', None)
+            if profile is None:
+                return response
+            endpoint = request.endpoint or 'unknown'
+            with self._lock:
+                self.requests.append((endpoint, profile.count, profile.seconds, profile.duplicates))
+            response.headers.add('Server-Timing',
+                                 f'db;dur={profile.seconds * 1000:.1f};desc="{profile.count} queries"')
+
+            if self.duplicate_warning and profile.statements:
+                (statement, _), repeats = profile.statements.most_common(1)[0]
+                if repeats >= self.duplicate_warning:
+                    logger.warning(f"{endpoint} ran the same query {repeats} times in one request: "
+                                   f"{_normalise(statement)[:200]}")
+            return response
+
+    def _plan(self, conn, statement, parameters):
+        """Query plan rows for a SELECT, run on the statement's own connection."""
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return []
+        # A raw DBAPI cursor, so the EXPLAIN itself is neither timed nor profiled
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        if conn.dialect.name == 'sqlite':
+            # (id, parent, notused, detail)
+            return [row[-1] for row in rows]
+        return [' | '.join(str(col) for col in row) for row in rows]
+
+    def _scanned_tables(self, dialect, plan):
+        if dialect == 'sqlite':
+            matches = (SQLITE_SCAN.match(line) for line in plan)
+        else:
+            matches = (POSTGRES_SCAN.search(line) for line in plan)
+        return sorted({m.group(1) for m in matches if m and not m.group(1).startswith('sqlite_')})
+
+    def _record_slow(self, conn, statement, parameters, seconds, executemany):
+        plan = []
+        if self.explain and not executemany:
+            try:
+                plan = self._plan(conn, statement, parameters)
+            except Exception as e:
+                plan = [f"EXPLAIN failed: {str(e)}"]
+        scans = self._scanned_tables(conn.dialect.name, plan)
+        endpoint = request.endpoint if has_request_context() else None
+
+        with self._lock:
+            self.table_scans.update(scans)
+            self.slow_queries.append({
+                'endpoint': endpoint or '-',
+                'ms': seconds * 1000,
+                'statement': _normalise(statement),
+                'plan': plan,
+                'table_scans': scans
+            })
+
+        message = f"slow query {seconds * 1000:.1f}ms endpoint={endpoint or '-'}: {_normalise(statement)}"
+        if plan:
+            message += '\n    plan: ' + '\n          '.join(plan)
+        if scans:
+            message += f"\n    full scan of {', '.join(scans)}: consider an index on the filtered columns"
+        self.slow_log.warning(message)
+
+    def summary(self):
+        """
+        Per-endpoint statistics over the recent requests, slowest first, with
+        the recent slow queries and the tables seen in full scans.
+        """
+        with self._lock:
+            requests = list(self.requests)
+            slow_queries = list(self.slow_queries)
+            table_scans = self.table_scans.most_common()
+
+        endpoints = {}
+        for endpoint, count, seconds, duplicates in requests:
+            stats = endpoints.setdefault(endpoint, {'endpoint': endpoint, 'requests': 0, 'queries': 0,
+                                                    'db_ms': 0.0, 'max_queries': 0, 'duplicates': 0})
+            stats['requests'] += 1
+            stats['queries'] += count
+            stats['db_ms'] += seconds * 1000
+            stats['max_queries'] = max(stats['max_queries'], count)
+            stats['duplicates'] += duplicates
+        for stats in endpoints.values():
+            stats['avg_queries'] = stats['queries'] / stats['requests']
+            stats['avg_db_ms'] = stats['db_ms'] / stats['requests']
+
+        return {
+            'endpoints': sorted(endpoints.values(), key=lambda s: s['avg_db_ms'], reverse=True),
+            'slow_queries': slow_queries[::-1],
+            'table_scans': table_scans,
+            'slow_query_ms': self.slow_query_seconds * 1000
+        }